@@ -0,0 +1,171 @@
+import sys, os, time, json, argparse, posixpath
+import loguru
+from executor import Executor, format_size
+from hosts import load_host
+from ratelimit import default_limiter
+import logconfig
+
+# 不需要显示器的命令行模式，和界面共用同一个 Executor，用于 cron、CI 和吞吐量测试
+# python cli.py get /remote/dir ./local
+# python cli.py --json --jobs 16 sync up ./build /srv/www
+# python cli.py run jobs.json
+logger = loguru.logger
+
+
+class Progress:
+    # 在 stderr 上原地刷新一行进度，不是终端时不输出
+    def __init__(self, label, enabled):
+        self.label = label
+        self.enabled = enabled and sys.stderr.isatty()
+        self.start = time.monotonic()
+        self.last = 0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if not self.enabled or (now - self.last < 0.2 and done < total):
+            return
+        self.last = now
+        rate = done / max(now - self.start, 1e-6)
+        percent = done * 100 // total if total else 100
+        sys.stderr.write(f'\r{self.label}: {format_size(done)}/{format_size(total)} ({percent}%) {format_size(int(rate))}/s ')
+        sys.stderr.flush()
+
+    def finish(self):
+        if self.enabled:
+            sys.stderr.write('\n')
+
+
+def transfer(executor, op, direction, items, args, sync=False):
+    start = time.monotonic()
+    job = executor.plan_transfer(direction, items, workers=args.jobs, sync=sync)
+    planned = time.monotonic()
+    progress = Progress(op, not args.quiet)
+    errors = job.run(progress)
+    progress.finish()
+    end = time.monotonic()
+    seconds = end - planned
+    # 只统计真正传输的文件和字节，已经存在而跳过的不算，否则吞吐量会虚高
+    return {
+        'op': op,
+        'direction': direction,
+        'items': items,
+        'files': len(job.files) - job.skipped,
+        'skipped': job.skipped,
+        'bytes': job.transferred,
+        'plan_seconds': round(planned - start, 3),
+        'seconds': round(seconds, 3),
+        'throughput': int(job.transferred / seconds) if seconds > 0 else 0,  # 字节/秒
+        'errors': [[path, str(e)] for path, e in errors],
+    }
+
+
+def list_dir(executor, path, args):
+    pager = executor.open_dir(path, 'remote')
+    entries = []
+    try:
+        while not pager.exhausted:
+            for info in pager.next_page(1000):
+                entries.append({'name': info.name, 'size': info.size, 'mtime': info.mtime,
+                                'permissions': info.permissions, 'owner': info.owner, 'group': info.group})
+                if not args.json:
+                    print(info)
+    finally:
+        pager.close()
+    return {'op': 'ls', 'path': path, 'entries': entries, 'errors': []}
+
+
+def run_op(executor, op, args):
+    # op 和任务文件里的一项格式一样：{"op": "get", "src": [...], "dst": "..."}
+    kind = op['op']
+    if kind == 'ls':
+        return list_dir(executor, op['src'], args)
+    sources = op['src'] if isinstance(op['src'], list) else [op['src']]
+    if kind == 'get':
+        # 和拖放一样，源放到目标目录下面
+        items = [(src, os.path.join(op['dst'], posixpath.basename(src.rstrip('/')))) for src in sources]
+        return transfer(executor, kind, 'download', items, args)
+    if kind == 'put':
+        items = [(src, posixpath.join(op['dst'], os.path.basename(src.rstrip(os.sep)))) for src in sources]
+        return transfer(executor, kind, 'upload', items, args)
+    if kind == 'sync':
+        # 同步时目标就是源的镜像，只传输目标端缺少、大小不同或者更旧的文件
+        direction = {'up': 'upload', 'down': 'download'}[op['direction']]
+        return transfer(executor, kind, direction, [(src, op['dst']) for src in sources], args, sync=True)
+    raise ValueError(f'不支持的操作: {kind}')
+
+
+def report(result, args):
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+        return
+    for path, error in result['errors']:
+        print(f'{result["op"]} 失败 {path}: {error}', file=sys.stderr)
+    if 'files' in result:
+        print(f'{result["op"]}: {result["files"]} 个文件, {format_size(result["bytes"])}, '
+              f'{result["seconds"]}s, {format_size(result["throughput"])}/s')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='cli.py', description='命令行批量传输')
+    parser.add_argument('--host', help='hosts.json 里的主机名，默认用 EASYSFTP_PROFILE 或 default')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='并行传输的文件数')
+    parser.add_argument('--rate', type=int, default=0, help='全局限速 KB/s，0 表示不限速')
+    parser.add_argument('--host-rate', type=int, help='这台主机的限速 KB/s，覆盖 hosts.json 里的 rate')
+    parser.add_argument('--json', action='store_true', help='每个操作输出一行 JSON 结果')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不显示进度')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出调试日志')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ls = sub.add_parser('ls', help='列出远程目录')
+    ls.add_argument('path')
+    get = sub.add_parser('get', help='下载到本地目录')
+    get.add_argument('src', nargs='+')
+    get.add_argument('dst')
+    put = sub.add_parser('put', help='上传到远程目录')
+    put.add_argument('src', nargs='+')
+    put.add_argument('dst')
+    sync = sub.add_parser('sync', help='把源目录同步成目标目录')
+    sync.add_argument('direction', choices=['up', 'down'])
+    sync.add_argument('src')
+    sync.add_argument('dst')
+    run = sub.add_parser('run', help='按任务文件依次执行')
+    run.add_argument('job_file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logconfig.setup_logging('DEBUG' if args.verbose else 'WARNING')
+    if args.command == 'run':
+        # 任务文件是一个 JSON 列表，每一项是一个操作
+        with open(args.job_file) as f:
+            ops = json.load(f)
+    elif args.command == 'ls':
+        ops = [{'op': 'ls', 'src': args.path}]
+    elif args.command == 'sync':
+        ops = [{'op': 'sync', 'direction': args.direction, 'src': args.src, 'dst': args.dst}]
+    else:
+        ops = [{'op': args.command, 'src': args.src, 'dst': args.dst}]
+
+    executor = Executor(**load_host(args.host))
+    executor.connect()
+    default_limiter.set_global_rate(args.rate * 1024)
+    if args.host_rate is not None:
+        default_limiter.set_host_rate(executor.hostname, args.host_rate * 1024)
+    failed = False
+    try:
+        for op in ops:
+            try:
+                result = run_op(executor, op, args)
+            except (IOError, OSError, ValueError, KeyError) as e:
+                # 一个操作失败不影响任务文件里后面的操作
+                result = {'op': op.get('op'), 'errors': [[str(op.get('src')), str(e)]]}
+            report(result, args)
+            failed = failed or bool(result['errors'])
+    finally:
+        executor.journal.close()
+        executor.disconnect()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
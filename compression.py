@@ -0,0 +1,71 @@
+import os, zlib
+
+# 已经压缩过的格式，再用 ssh 压缩只会浪费 CPU
+COMPRESSED_EXTENSIONS = {
+    'gz', 'tgz', 'bz2', 'xz', 'zst', 'lz4', 'lzma', 'zip', '7z', 'rar', 'br',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'avif',
+    'mp4', 'mkv', 'mov', 'avi', 'webm', 'mp3', 'aac', 'ogg', 'opus', 'flac', 'm4a',
+    'pdf', 'docx', 'xlsx', 'pptx', 'jar', 'whl', 'apk', 'deb', 'rpm',
+    'parquet', 'orc',
+}
+
+# 文本类的格式压缩率很高，不用采样
+TEXT_EXTENSIONS = {
+    'txt', 'log', 'csv', 'tsv', 'json', 'jsonl', 'ndjson', 'xml', 'html', 'htm', 'sql',
+    'md', 'rst', 'yaml', 'yml', 'ini', 'conf', 'cfg', 'py', 'c', 'h', 'cpp', 'js', 'ts',
+    'css', 'sh', 'java', 'go', 'rs', 'tex', 'svg',
+}
+
+SAMPLE_SIZE = 32 * 1024
+MIN_SAMPLE_FILE_SIZE = 1024 * 1024  # 小文件不值得为采样多花一次往返
+RATIO_THRESHOLD = 0.8  # 压缩后小于原来的 80% 才走压缩通道
+
+
+def extension(path):
+    name = os.path.basename(path)
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def sample_ratio(samples):
+    data = b''.join(samples)
+    if not data:
+        return 1.0
+    return len(zlib.compress(data, 1)) / len(data)
+
+
+def sample_ranges(size):
+    # 开头和中间各取一段，避免只看到文件头
+    ranges = [(0, min(SAMPLE_SIZE, size))]
+    if size > 2 * SAMPLE_SIZE:
+        ranges.append((size // 2, SAMPLE_SIZE))
+    return ranges
+
+
+def sample_local(path, size):
+    samples = []
+    with open(path, 'rb') as f:
+        for offset, length in sample_ranges(size):
+            f.seek(offset)
+            samples.append(f.read(length))
+    return samples
+
+
+def sample_remote(sftp, path, size):
+    # readv 把两段一起请求，只花一次往返
+    with sftp.open(path, 'rb') as f:
+        return list(f.readv(sample_ranges(size)))
+
+
+def should_compress(path, size, sampler):
+    # 先看扩展名，判断不了的大文件再采样一小段试压缩
+    ext = extension(path)
+    if ext in COMPRESSED_EXTENSIONS:
+        return False
+    if ext in TEXT_EXTENSIONS:
+        return True
+    if size < MIN_SAMPLE_FILE_SIZE:
+        return False
+    try:
+        return sample_ratio(sampler()) < RATIO_THRESHOLD
+    except (IOError, OSError):
+        return False
@@ -0,0 +1,189 @@
+import os, shutil, errno
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import loguru
+
+logger = loguru.logger
+
+
+class LocalCopyEngine:
+    # 进程内的本地复制/移动，代替 os.popen('cp -r ...')
+    # 文件内容用 copy_file_range/sendfile 在内核里拷贝，多个文件用线程池并行
+    def __init__(self, workers=8, chunk_size=64 * 1024 * 1024):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._done = 0
+
+    def plan(self, src, dst):
+        # 返回 (要创建的目录, [(源文件, 目标文件, 大小)], [(链接, 目标)])
+        if not os.path.isdir(src) or os.path.islink(src):
+            if os.path.islink(src):
+                return [], [], [(src, dst)]
+            return [], [(src, dst, os.path.getsize(src))], []
+        dirs, files, links = [dst], [], []
+        for cur_dir, sub_dirs, file_names in os.walk(src):
+            rel = os.path.relpath(cur_dir, src)
+            target_dir = os.path.normpath(os.path.join(dst, rel))
+            for name in list(sub_dirs):
+                sub_path = os.path.join(cur_dir, name)
+                if os.path.islink(sub_path):
+                    links.append((sub_path, os.path.join(target_dir, name)))
+                    sub_dirs.remove(name)
+                else:
+                    dirs.append(os.path.join(target_dir, name))
+            for name in file_names:
+                sub_path = os.path.join(cur_dir, name)
+                if os.path.islink(sub_path):
+                    links.append((sub_path, os.path.join(target_dir, name)))
+                else:
+                    files.append((sub_path, os.path.join(target_dir, name), os.lstat(sub_path).st_size))
+        return dirs, files, links
+
+    def _add_done(self, n):
+        with self._lock:
+            self._done += n
+
+    def copy_file(self, src, dst):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+            size = os.fstat(in_fd).st_size
+            copied = self._copy_file_range(in_fd, out_fd, size)
+            if copied is None:
+                copied = self._sendfile(in_fd, out_fd, size)
+            if copied is None:
+                # 都不支持就退回到普通的读写
+                os.lseek(in_fd, 0, os.SEEK_SET)
+                os.lseek(out_fd, 0, os.SEEK_SET)
+                while True:
+                    buf = fsrc.read(1024 * 1024)
+                    if not buf:
+                        break
+                    fdst.write(buf)
+                    self._add_done(len(buf))
+        shutil.copystat(src, dst)
+
+    def _copy_file_range(self, in_fd, out_fd, size):
+        if not hasattr(os, 'copy_file_range'):
+            return None
+        offset = 0
+        try:
+            while offset < size:
+                n = os.copy_file_range(in_fd, out_fd, min(self.chunk_size, size - offset))
+                if n == 0:
+                    break
+                offset += n
+                self._add_done(n)
+        except OSError as e:
+            if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                return None
+            raise
+        return offset
+
+    def _sendfile(self, in_fd, out_fd, size):
+        if not hasattr(os, 'sendfile'):
+            return None
+        offset = 0
+        try:
+            while offset < size:
+                n = os.sendfile(out_fd, in_fd, offset, min(self.chunk_size, size - offset))
+                if n == 0:
+                    break
+                offset += n
+                self._add_done(n)
+        except OSError as e:
+            if offset == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK):
+                return None
+            raise
+        return offset
+
+    def copy(self, src, dst, progress=None):
+        return self.copy_many([(src, dst)], progress)
+
+    def copy_many(self, items, progress=None):
+        # 多个源先一起规划，再放进同一个线程池
+        # progress(已完成字节, 总字节) 在调用者的线程里回调，返回出错的 [(路径, 错误)]
+        dirs, files, links = [], [], []
+        for src, dst in items:
+            sub_dirs, sub_files, sub_links = self.plan(src, dst)
+            dirs += sub_dirs
+            files += sub_files
+            links += sub_links
+        total = sum(size for _, _, size in files)
+        self._done = 0
+        errors = []
+        for dir_path in dirs:
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except OSError as e:
+                errors.append((dir_path, e))
+        for link_path, target in links:
+            try:
+                os.symlink(os.readlink(link_path), target)
+            except OSError as e:
+                errors.append((link_path, e))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.copy_file, s, d): s for s, d, _ in files}
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future.exception() is not None:
+                        errors.append((futures[future], future.exception()))
+                if progress is not None:
+                    progress(self._done, total)
+        # 目录的时间戳要在里面的文件写完之后再设置
+        for src, dst in items:
+            if not os.path.isdir(src) or os.path.islink(src):
+                continue
+            for dir_path in reversed(dirs):
+                if dir_path != dst and not dir_path.startswith(dst + os.sep):
+                    continue
+                src_dir = os.path.join(src, os.path.relpath(dir_path, dst))
+                try:
+                    shutil.copystat(src_dir, dir_path)
+                except OSError:
+                    pass
+        for path, e in errors:
+            logger.error(f'复制失败 {path}: {e}')
+        return errors
+
+    def move(self, src, dst, progress=None):
+        return self.move_many([(src, dst)], progress)
+
+    def move_many(self, items, progress=None):
+        # 同一个文件系统里直接 rename，跨文件系统的放在一起复制（一个任务、一个线程池）再删除
+        errors = []
+        to_copy = []
+        for src, dst in items:
+            try:
+                same_fs = os.lstat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+            except OSError as e:
+                logger.error(f'移动失败 {src}: {e}')
+                errors.append((src, e))
+                continue
+            if same_fs:
+                try:
+                    os.rename(src, dst)
+                    continue
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        logger.error(f'移动失败 {src}: {e}')
+                        errors.append((src, e))
+                        continue
+            to_copy.append((src, dst))
+        if not to_copy:
+            return errors
+        copy_errors = self.copy_many(to_copy, progress)
+        errors += copy_errors
+        # 只删除完整复制过去的源
+        failed = [path for path, _ in copy_errors]
+        for src, dst in to_copy:
+            if any(path == src or path.startswith(src.rstrip(os.sep) + os.sep) or
+                   path == dst or path.startswith(dst.rstrip(os.sep) + os.sep) for path in failed):
+                continue
+            if os.path.isdir(src) and not os.path.islink(src):
+                shutil.rmtree(src)
+            else:
+                os.remove(src)
+        return errors
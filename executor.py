@@ -0,0 +1,404 @@
+import sys, os, re, stat, time, threading
+import paramiko
+import loguru
+from copyengine import LocalCopyEngine
+from remoteops import RemoteOps
+from transferjob import TransferJob
+from transfercore import TransferTuner, pipelined_get, pipelined_put
+from ratelimit import default_limiter
+from journal import TransferJournal
+from walker import DirPager
+import walker
+import manifest
+from localfs import LocalDirPager, owner_name, group_name
+import compression
+import logconfig
+
+# 不依赖 Qt 的部分：界面和命令行共用同一个 Executor
+logger = loguru.logger
+
+
+# 按 ls -h 的风格显示大小
+def format_size(size):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if size < 1024:
+            return f'{size}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}P'
+
+
+# ls -l 的一行，模块加载时编译一次
+LS_PATTERN = re.compile(
+    r'^(?P<permissions>[-dlcbps][rwxsStT\-]{9})[@+.]?\s+'
+    r'(?P<links>\d+)\s+'
+    r'(?P<owner>\w+)\s+'
+    r'(?P<group>\w+)\s+'
+    r'(?P<size>[\d\.]+[BKMGTP]?)\s+'
+    r'(?P<month>\w+)\s+'
+    r'(?P<day>\d+)\s+'
+    r'(?P<time>[\d:]+)\s+'
+    r'(?P<name>.+)$',
+    re.MULTILINE
+)
+
+FILE_TYPE_BITS = {'-': stat.S_IFREG, 'd': stat.S_IFDIR, 'l': stat.S_IFLNK, 'c': stat.S_IFCHR,
+                  'b': stat.S_IFBLK, 'p': stat.S_IFIFO, 's': stat.S_IFSOCK}
+SIZE_UNITS = {'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4, 'P': 1024 ** 5}
+
+
+# 把 drwxr-xr-x 这样的权限字符串转换回 st_mode
+def parse_permissions(permissions):
+    mode = FILE_TYPE_BITS.get(permissions[0], stat.S_IFREG)
+    bits = [stat.S_IRUSR, stat.S_IWUSR, stat.S_IXUSR, stat.S_IRGRP, stat.S_IWGRP, stat.S_IXGRP,
+            stat.S_IROTH, stat.S_IWOTH, stat.S_IXOTH]
+    specials = {2: stat.S_ISUID, 5: stat.S_ISGID, 8: stat.S_ISVTX}
+    for i, c in enumerate(permissions[1:10]):
+        if c in 'rwxst':
+            mode |= bits[i]
+        if c in 'sStT':
+            mode |= specials[i]
+    return mode
+
+
+# ls -h 的大小 (4.0K) 转换成字节数
+def parse_size(size):
+    unit = SIZE_UNITS.get(size[-1])
+    if unit is None:
+        return int(float(size))
+    return int(float(size[:-1]) * unit)
+
+
+# ls 的时间 (Oct 02 21:07 或 Oct 02 2023) 转换成时间戳
+def parse_ls_time(month, day, clock):
+    now = time.localtime()
+    try:
+        if ':' in clock:
+            t = time.strptime(f'{now.tm_year} {month} {day} {clock}', '%Y %b %d %H:%M')
+            # 最近半年的文件 ls 只显示时间不显示年份，比现在晚说明是去年的
+            if time.mktime(t) > time.time() + 86400:
+                t = time.strptime(f'{now.tm_year - 1} {month} {day} {clock}', '%Y %b %d %H:%M')
+        else:
+            t = time.strptime(f'{clock} {month} {day}', '%Y %b %d')
+    except ValueError:
+        return 0
+    return int(time.mktime(t))
+
+
+class FileInfo:
+    # 大目录里会有成千上万个 FileInfo，所以用 __slots__ 去掉每个对象的 __dict__，
+    # owner/group/扩展名做字符串驻留，大小和时间都存整数，不保留原始的 ls 行
+    __slots__ = ('name', 'file_type', 'mode', 'links', 'owner', 'group', 'size', 'mtime')
+
+    def __init__(self, name, mode, size=0, mtime=0, links=1, owner='', group=''):
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+        self.links = links
+        self.owner = sys.intern(owner)
+        self.group = sys.intern(group)
+        if stat.S_ISDIR(mode):
+            self.file_type = 'folder'
+        else:
+            self.file_type = sys.intern(name.rsplit('.', 1)[-1]) if '.' in name else ''
+
+    @classmethod
+    def from_match(cls, match):
+        return cls(match.group('name'),
+                   parse_permissions(match.group('permissions')),
+                   size=parse_size(match.group('size')),
+                   mtime=parse_ls_time(match.group('month'), match.group('day'), match.group('time')),
+                   links=int(match.group('links')),
+                   owner=match.group('owner'),
+                   group=match.group('group'))
+
+    @classmethod
+    def parse_description(cls, description):
+        match = LS_PATTERN.match(description)
+        if match:
+            return cls.from_match(match)
+        else:
+            raise ValueError('Invalid file description format')
+
+    # 一次扫描整个 ls 输出，不合法的行自然被跳过
+    @classmethod
+    def parse_listing(cls, output):
+        return [cls.from_match(match) for match in LS_PATTERN.finditer(output)]
+
+    # 直接用 stat 的结果构造，不用再解析 ls 的输出
+    # st 可以是 os.stat_result 也可以是 SFTPAttributes，两者的字段是一样的
+    @classmethod
+    def from_stat(cls, name, st, owner=None, group=None):
+        return cls(name, st.st_mode or 0,
+                   size=st.st_size or 0,
+                   mtime=int(st.st_mtime or 0),
+                   links=getattr(st, 'st_nlink', 1),
+                   owner=owner or str(st.st_uid),
+                   group=group or str(st.st_gid))
+
+    @classmethod
+    def from_attr(cls, attr):
+        return cls.from_stat(attr.filename, attr)
+
+    @property
+    def isdir(self):
+        return self.file_type == 'folder'
+
+    @property
+    def permissions(self):
+        return stat.filemode(self.mode)
+
+    @property
+    def last_modified(self):
+        return time.strftime('%b %d %H:%M', time.localtime(self.mtime))
+
+    def __str__(self):
+        return f"{self.permissions} {self.links} {self.owner} {self.group} {format_size(self.size)} {self.last_modified} {self.name}"
+
+
+# 使用单例模式来进行设计
+class Executor:
+    _instance = None
+    def __init__(self, hostname, port, username, password, rate=0):
+        _instance = None
+        self.hostname = hostname
+        self.port = port 
+        self.username = username
+        self.password = password
+        self.ssh = None
+        self.compressed_ssh = None # 开了压缩的第二个连接，需要时才建立
+        self._compressed_lock = threading.Lock()
+        self.sftp = None
+        self.remote_ops = None
+        self.tuner = None
+        self.limiter = default_limiter
+        if rate:
+            # 单位 KB/s，和全局限速一起生效
+            self.limiter.set_host_rate(hostname, rate * 1024)
+        self.journal = TransferJournal()
+        self.copy_engine = LocalCopyEngine()
+       
+    @classmethod
+    def get_instance(cls, hostname, port, username, password, rate=0):
+        if cls._instance is None:
+            cls._instance = cls(hostname, port, username, password, rate)
+            try:
+                cls._instance.connect() # 连接
+            except Exception as e:
+                print(e)
+        return cls._instance
+    
+    def connect(self):
+        self.ssh = paramiko.SSHClient()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh.connect(self.hostname,
+                         self.port,
+                         self.username,
+                         self.password
+                         )
+        self.tuner = TransferTuner(self.hostname)
+        self.sftp = self.open_sftp()
+        self.tuner.measure_rtt(self.sftp)
+        self.tuner.query_limits(self.sftp)
+        self.remote_ops = RemoteOps(self.ssh, self.sftp, self.walk_remote)
+
+    # 按调好的窗口大小开一个新的 sftp 通道，compress=True 时走开了压缩的连接
+    def open_sftp(self, compress=False):
+        transport = self.compressed_transport() if compress else self.ssh.get_transport()
+        return self.tuner.open_sftp(transport)
+
+    def compressed_transport(self):
+        with self._compressed_lock:
+            if self.compressed_ssh is None:
+                ssh = paramiko.SSHClient()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh.connect(self.hostname,
+                            self.port,
+                            self.username,
+                            self.password,
+                            compress=True
+                            )
+                self.compressed_ssh = ssh
+        return self.compressed_ssh.get_transport()
+
+    # 已经压缩过的格式不压缩，文本类的压缩，其他的大文件采样试压缩一下再决定
+    # sftp 传当前线程自己的通道，用来读远程文件的采样
+    def should_compress(self, direction, src, size, sftp):
+        if direction == 'upload':
+            sampler = lambda: compression.sample_local(src, size)
+        else:
+            sampler = lambda: compression.sample_remote(sftp, src, size)
+        return compression.should_compress(src, size, sampler)
+
+    def disconnect(self):
+        if self.ssh:
+            self.ssh.close()
+        if self.compressed_ssh:
+            self.compressed_ssh.close()
+        
+    # def download(self, remote_path, local_path):
+    #     # self.sftp.get(remotepath = remote_path, localpath=local_path)
+    #     command = f'get -r {remote_path} {local_path}'  # 文件和文件夹都可以用递归
+    #     logger.debug(command)
+    #     stdin, stdout, stderr = self.sftp.exec_command(command)
+    #     logger.debug(stdout.read().decode())
+    #     logger.debug(stderr.read().decode())
+    #     logger.info('下载成功')
+    
+    
+    # ref: https://blog.csdn.net/RayMand168/article/details/135463557
+    def download(self, remote_path, local_path, progress=None):  # eg: remote_path : /home/dir   local_path: /home/urahyou/  -> /home/urahyou/dir
+        return self.transfer('download', [(remote_path, local_path)], progress)
+                
+    def upload(self, local_path, remote_path, progress=None):
+        return self.transfer('upload', [(local_path, remote_path)], progress)
+
+    # 多个源一起规划、一起传输，返回出错的 [(路径, 错误)]
+    def transfer(self, direction, items, progress=None):
+        return self.plan_transfer(direction, items).run(progress)
+
+    # 只规划不传输，sync=True 时去掉目标端已经是最新的文件
+    def plan_transfer(self, direction, items, workers=8, sync=False):
+        job = TransferJob(self, direction, items, workers)
+        job.plan()
+        if sync:
+            skipped = job.prune_unchanged()
+            logger.debug(f'{direction}: {skipped} 个文件已经是最新的')
+        return job
+
+    # 从日志里恢复没完成的任务
+    def resume(self, job_id, direction, items, progress=None):
+        job = TransferJob.resume(self, job_id, direction, items)
+        return job.run(progress)
+
+    # 递归列出远程目录，yield (完整路径, SFTPAttributes)
+    # 优先在服务器上执行一次 find，一次往返拿到整棵树，不支持时退回到 sftp 流水线遍历
+    # 服务器支不支持只在第一次时探测，root 本身出错时抛出 IOError，不会因此改用 sftp 遍历
+    def walk_remote(self, root):
+        try:
+            yield from manifest.find_entries(self.ssh, root)
+            return
+        except manifest.FindUnsupported as e:
+            logger.debug(f'{self.hostname} 不支持 find 清单, 改用 sftp 遍历: {e}')
+        yield from walker.walk(self.sftp, root)
+
+    def get_file(self, remote_path, local_path, sftp=None, start=0, callback=None):
+        sftp = sftp or self.sftp
+        if logconfig.enabled('DEBUG'):
+            logger.debug('开始下载文件：{}'.format(remote_path))
+        pipelined_get(sftp, remote_path, local_path, self.tuner, callback=callback, limiter=self.limiter, start=start)
+
+    def put_file(self, local_path, remote_path, sftp=None, start=0, callback=None):
+        sftp = sftp or self.sftp
+        if logconfig.enabled('DEBUG'):
+            logger.debug('开始上传文件：{}'.format(local_path))
+        pipelined_put(sftp, local_path, remote_path, self.tuner, callback=callback, limiter=self.limiter, start=start)
+            
+
+    def check_remote_dir(self, remote_path):
+        # 如果远程不存在目录则创建，直接 stat 一次，不用列出整个父目录
+        try:
+            self.sftp.stat(remote_path)
+        except IOError:
+            self.sftp.mkdir(remote_path)
+    
+        
+    def check_local_dir(self, local_path):
+        if not os.path.exists(local_path):
+            os.makedirs(local_path)
+            
+    # 给了 size 时大小一致才算已经存在，避免跳过写了一半的文件
+    def check_local_file(self, local_path, size=None):
+        if os.path.exists(local_path):
+            return size is None or os.path.getsize(local_path) == size
+        else:
+            return False
+        
+    def check_remote_file(self, remote_path):
+        return False
+        
+        
+    # def upload(self, local_path, remote_path):
+    #     print(f'local_path: {local_path}, remote_path: {remote_path}')
+    #     self.sftp.put(localpath=local_path, remotepath=remote_path)
+    #     logger.info('上传成功')
+        
+    def local_move(self, from_path, to_path, progress=None):
+        # 同一个文件系统里就是一次 rename
+        logger.debug(f'local_move: {from_path} -> {to_path}')
+        return self.copy_engine.move(from_path, to_path, progress)
+
+    # 多个源作为一个任务，返回出错的 [(路径, 错误)]
+    def local_move_many(self, items, progress=None):
+        logger.debug(f'local_move: {len(items)} 项')
+        return self.copy_engine.move_many(items, progress)
+
+    def local_copy(self, from_path, to_path, progress=None):
+        logger.debug(f'local_copy: {from_path} -> {to_path}')
+        return self.copy_engine.copy(from_path, to_path, progress)
+
+    def remote_move(self, from_path, to_path, progress=None):
+        logger.debug(f'remote_move: {from_path} -> {to_path}')
+        return self.remote_ops.move(from_path, to_path, progress)
+
+    def remote_copy(self, from_path, to_path, progress=None):
+        logger.debug(f'remote_copy: {from_path} -> {to_path}')
+        return self.remote_ops.copy(from_path, to_path, progress)
+
+    def remote_move_many(self, items, progress=None):
+        logger.debug(f'remote_move: {len(items)} 项')
+        return self.remote_ops.move_many(items, progress)
+
+    def remote_copy_many(self, items, progress=None):
+        logger.debug(f'remote_copy: {len(items)} 项')
+        return self.remote_ops.copy_many(items, progress)
+    
+    def execute_command(self, command, type):
+        output = None
+        errors = None
+        if type == "remote":
+            if not self.ssh:
+                raise Exception("SSH connection not established")
+            # print('you are here')
+            stdin, stdout, stderr = self.ssh.exec_command(command)
+            output = stdout.read().decode()
+            errors = stderr.read().decode()
+        elif type == "local":
+            # path = command.split(' ')[-1]
+            # output = self.ls(path)
+            # print(f'command: {command}')
+            output = os.popen(command).read()
+            # logger.debug(output)
+        else:
+            logger.error('type error! not a valid type (local, remote)')
+           
+        return output, errors
+    
+    # 返回一个分页读取目录的对象，next_page(count) 每次返回最多 count 个 FileInfo
+    def open_dir(self, path, loc):
+        if loc == 'remote':
+            return FileInfoPager(DirPager(self.sftp, path), FileInfo.from_attr)
+        # 本地直接 scandir，和远程一样返回结构化的 FileInfo
+        return FileInfoPager(LocalDirPager(path),
+                             lambda entry: FileInfo.from_stat(entry[0], entry[1], owner_name(entry[1].st_uid), group_name(entry[1].st_gid)))
+
+    def parse_ls_output(self, output):
+        # 无效行（比如 total 那一行）会被忽略
+        return FileInfo.parse_listing(output)
+        
+
+# 把远程/本地分页器返回的条目转换成 FileInfo
+class FileInfoPager:
+    def __init__(self, pager, convert):
+        self.pager = pager
+        self.convert = convert
+
+    @property
+    def exhausted(self):
+        return self.pager.exhausted
+
+    def next_page(self, count):
+        return [self.convert(entry) for entry in self.pager.next_page(count)]
+
+    def close(self):
+        self.pager.close()
@@ -1,14 +1,23 @@
 import sys
 from PyQt5.QtGui import QCloseEvent, QIcon, QDrag, QStandardItemModel, QStandardItem
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTreeWidget, QTreeWidgetItem,\
-    QHBoxLayout, QWidget, QTreeView, QLabel, QLineEdit, QPushButton, QFileDialog, QVBoxLayout
-from PyQt5.QtCore import QMimeData, Qt, QModelIndex, QThread, QCoreApplication
+    QHBoxLayout, QWidget, QTreeView, QAbstractItemView, QLabel, QLineEdit, QPushButton, QFileDialog, QVBoxLayout, QSpinBox, QMessageBox
+from PyQt5.QtCore import QMimeData, Qt, QModelIndex, QPersistentModelIndex, QThread, QCoreApplication, QTimer, pyqtSignal
 import paramiko
 import re, os, stat
 import logging, loguru
 import pytest
 import time
 import asyncio
+from foldersize import FolderSizeCache, FolderSizeThread
+from preview import PreviewWidget
+from ratelimit import default_limiter
+from executor import Executor, FileInfo, format_size
+from hosts import load_host
+from treememory import ListPager, ListingCache, process_rss, ROW_BYTES, INFO_BYTES
+from collections import OrderedDict
+import logconfig
+import json
 
 # logging.basicConfig(level = logging.DEBUG, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 # logger = logging.getLogger(__name__)
@@ -16,196 +25,6 @@ import asyncio
 logger = loguru.logger
 
 
-class FileInfo:
-    def __init__(self, description):
-        self.description = description
-        self.parse_description()
-    
-    def parse_description(self):
-        pattern = re.compile(
-            r'(?P<permissions>[drwx\-@+.]+)\s+'
-            r'(?P<links>\d+)\s+'
-            r'(?P<owner>\w+)\s+'
-            r'(?P<group>\w+)\s+'
-            r'(?P<size>[\d\.]+[BKMG]?)\s+'
-            r'(?P<month>\w+)\s+'
-            r'(?P<day>\d+)\s+'
-            r'(?P<time>[\d:]+)\s+'
-            r'(?P<name>.+)'
-        )
-        match = pattern.match(self.description)
-        if match:
-            self.permissions = match.group('permissions')
-            self.links = int(match.group('links'))
-            self.owner = match.group('owner')
-            self.group = match.group('group')
-            self.size = match.group('size')
-            self.last_modified = f"{match.group('month')} {match.group('day')} {match.group('time')}"
-            self.name = match.group('name')
-            # self.isdir = True if self.permissions[0] == 'd' else False 
-            if self.permissions[0] == 'd':
-                self.file_type = 'folder'
-            else:
-                self.file_type = self.name.split('.')[-1] if '.' in self.name else ''
-        else:
-            raise ValueError('Invalid file description format')
-    
-    def __str__(self):
-        return f"{self.permissions} {self.links} {self.owner} {self.group} {self.size} {self.last_modified} {self.name}"
-
-
-# 使用单例模式来进行设计
-class Executor:
-    _instance = None
-    def __init__(self, hostname, port, username, password):
-        _instance = None
-        self.hostname = hostname
-        self.port = port 
-        self.username = username
-        self.password = password
-        self.ssh = None
-        self.sftp = None
-       
-    @classmethod
-    def get_instance(cls, hostname, port, username, password):
-        if cls._instance is None:
-            cls._instance = cls(hostname, port, username, password)
-            try:
-                cls._instance.connect() # 连接
-            except Exception as e:
-                print(e)
-        return cls._instance
-    
-    def connect(self):
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(self.hostname,
-                         self.port,
-                         self.username,
-                         self.password
-                         )
-        self.sftp = self.ssh.open_sftp()
-
-    def disconnect(self):
-        if self.ssh:
-            self.ssh.close()
-        
-    # def download(self, remote_path, local_path):
-    #     # self.sftp.get(remotepath = remote_path, localpath=local_path)
-    #     command = f'get -r {remote_path} {local_path}'  # 文件和文件夹都可以用递归
-    #     logger.debug(command)
-    #     stdin, stdout, stderr = self.sftp.exec_command(command)
-    #     logger.debug(stdout.read().decode())
-    #     logger.debug(stderr.read().decode())
-    #     logger.info('下载成功')
-    
-    
-    # ref: https://blog.csdn.net/RayMand168/article/details/135463557
-    def download(self, remote_path, local_path):  # eg: remote_path : /home/dir   local_path: /home/urahyou/  -> /home/urahyou/dir
-        remote_file = self.sftp.stat(remote_path)
-        if stat.S_ISDIR(remote_file.st_mode): # 如果是文件夹则要递归下载
-            self.check_local_dir(local_path)
-            logger.debug('开始下载文件夹：{}'.format(remote_path))
-            for remote_file_name in self.sftp.listdir(remote_path):
-                sub_remote_path = os.path.join(remote_path, remote_file_name)
-                sub_local_path = os.path.join(local_path, remote_file_name)
-                self.download(sub_remote_path, sub_local_path) # 递归下载
-        else:
-            # 已经到了文件就直接下载
-            logger.debug('开始下载文件：{}'.format(remote_path))
-            if self.check_local_file(local_path): 
-                logger.debug(f'{local_path} 已经存在, 跳过:')
-            else:
-                logger.debug(f'remote_path: {remote_path}, local_path: {local_path}')
-                self.sftp.get(remotepath = remote_path, localpath = local_path)
-                
-                
-    def upload(self, local_path, remote_path):
-        if os.path.isdir(local_path):
-            self.check_remote_dir(remote_path)
-            logger.debug('开始上传文件夹：{}'.format(local_path))
-            for local_file in os.listdir(local_path):
-                sub_remote_path = os.path.join(remote_path, local_file)
-                sub_local_path = os.path.join(local_path, local_file)
-                self.upload(sub_local_path, sub_remote_path) # 递归上传
-        else:
-            # 已经到了文件就直接上传
-            logger.debug('开始上传文件：{}'.format(local_path))
-            if self.check_remote_dir()
-            logger.debug(f'localpath: {local_path}, remote_path: {remote_path}')
-            self.sftp.put(localpath=local_path, remotepath=remote_path) 
-            
-
-    def check_remote_dir(self, remote_path):
-        remote_file_name = remote_path.split('/')[-1]
-        remote_path_parent = '/'.join(remote_path.split('/')[:-2])
-        # 如果远程不存在目录则创建
-        if remote_file_name not in self.sftp.listdir(remote_path_parent):
-            self.sftp.mkdir(remote_path)
-    
-        
-    def check_local_dir(self, local_path):
-        if not os.path.exists(local_path):
-            os.makedirs(local_path)
-            
-    def check_local_file(self, local_path):
-        if os.path.exists(local_path):
-            return True
-        else:
-            return False
-        
-    def check_remote_file(self, remote_path):
-        return False
-        
-        
-    # def upload(self, local_path, remote_path):
-    #     print(f'local_path: {local_path}, remote_path: {remote_path}')
-    #     self.sftp.put(localpath=local_path, remotepath=remote_path)
-    #     logger.info('上传成功')
-        
-    def local_move(self, from_path, to_path):
-        command = f"mv {from_path} {to_path}" # mv是不用加-r也可以移动文件夹的
-        logger.debug(f'command: {command}')
-        r = os.popen(command)
-        output = r.read()
-        r.close()
-        return output
-    
-    def execute_command(self, command, type):
-        output = None
-        errors = None
-        if type == "remote":
-            if not self.ssh:
-                raise Exception("SSH connection not established")
-            # print('you are here')
-            stdin, stdout, stderr = self.ssh.exec_command(command)
-            output = stdout.read().decode()
-            errors = stdout.read().decode()
-        elif type == "local":
-            # path = command.split(' ')[-1]
-            # output = self.ls(path)
-            # print(f'command: {command}')
-            output = os.popen(command).read()
-            # logger.debug(output)
-        else:
-            logger.error('type error! not a valid type (local, remote)')
-           
-        return output, errors
-    
-    def parse_ls_output(self, output):
-        file_infos = []
-        lines = output.split('\n')
-        for line in lines:
-            if line:
-                try:
-                    file_info = FileInfo(line)
-                    file_infos.append(file_info)
-                except ValueError:
-                    # 忽略无效行
-                    continue
-        return file_infos
-        
-
 class Utils():
     # 在model里面按照index获取path
     @staticmethod
@@ -223,6 +42,9 @@ class Utils():
             parent_index = parent_index.parent()
         full_path = os.path.join(root_path, full_path)
         return full_path
+
+    # 按 ls -h 的风格显示大小
+    format_size = staticmethod(format_size)
         
             
 class FileTreeView(QTreeView):
@@ -234,60 +56,267 @@ class FileTreeView(QTreeView):
         self.root_path = root_path
         self.loc = loc
         # 获取一个统一的单例
-        self.executor = Executor.get_instance(hostname='', port=22, username='', password='')
+        self.executor = Executor.get_instance(**load_host())
         # 连接槽函数
         self.expanded.connect(self.onItemExpand)
+        self.collapsed.connect(self.onItemCollapse)
+        # 正在后台计算大小的目录 {path: FolderSizeThread}
+        self.size_threads = {}
         
         # 设置一些属性
         self.setDragEnabled(True)
         self.setAcceptDrops(True)
+        self.setDefaultDropAction(Qt.CopyAction)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        
+    def dropEvent(self, event):
+        super(FileTreeView, self).dropEvent(event)
+        # 跨两棵树的拖放只做复制，不能让源视图把拖走的行删掉
+        if event.source() is not self and event.dropAction() == Qt.MoveAction:
+            event.setDropAction(Qt.CopyAction)
+
+    def onItemExpand(self, index):
+        # 子节点由 model 的 fetchMore 按页加载，这里只需要算文件夹大小
+        cur_full_path = Utils.get_path_from_index(self.root_path, self.model(), index)
+        self.model().set_expanded(cur_full_path, True)
+        self.request_folder_sizes(index, cur_full_path)
+
+    def onItemCollapse(self, index):
+        cur_full_path = Utils.get_path_from_index(self.root_path, self.model(), index)
+        # 收起来的子树可以被换出
+        self.model().set_expanded(cur_full_path, False)
+        # 为这一层的行计算大小的线程：整棵子树或者其中某个子目录
+        for target, thread in list(self.size_threads.items()):
+            if target == cur_full_path or os.path.dirname(target) == cur_full_path:
+                del self.size_threads[target]
+                thread.cancel()
+
+    def request_folder_sizes(self, index, path):
+        # 缓存里有就直接填；这个目录算过的话只在后台重算缺少或者变脏的子目录，从没算过才算整棵子树
+        missing = self.fill_folder_sizes(index, path)
+        if not missing:
+            return
+        targets = missing if self.model().size_cache.known(path) else [path]
+        for target in targets:
+            if target in self.size_threads:
+                continue
+            thread = FolderSizeThread(target, self.loc, ssh=self.executor.ssh, parent=self)
+            thread.sizes_ready.connect(lambda p, totals, idx=QPersistentModelIndex(index), fill_path=path: self.on_sizes_ready(idx, fill_path, p, totals))
+            thread.finished.connect(lambda p=target, t=thread: self.size_threads.pop(p, None) if self.size_threads.get(p) is t else None)
+            self.size_threads[target] = thread
+            thread.start()
+
+    def on_sizes_ready(self, index, fill_path, path, totals):
+        # 祖先目录的大小由 replace_subtree 按差值更新
+        self.model().size_cache.replace_subtree(path, totals)
+        if index.isValid() or fill_path == self.root_path:
+            self.fill_folder_sizes(QModelIndex(index), fill_path)
+
+    def fill_folder_sizes(self, index, path):
+        # 返回缓存里还没有大小的子目录
+        model = self.model()
+        cache = model.size_cache
+        node = model.itemFromIndex(index) if index.isValid() else model.invisibleRootItem()
+        missing = []
+        for row in range(node.rowCount()):
+            name_item, type_item, size_item = node.child(row, 0), node.child(row, 1), node.child(row, 2)
+            if type_item is None or type_item.text() != 'folder':
+                continue
+            child_path = os.path.join(path, name_item.text())
+            size = cache.get(child_path)
+            if size is None:
+                missing.append(child_path)
+            else:
+                size_item.setText(Utils.format_size(size))
+        return missing
+
+    def on_reloaded(self, path):
+        # 拖放之后目录重新列了：它自己的子目录大小，以及它在上一层那一行的大小都要重新填
+        model = self.model()
+        for dir_path in (path, os.path.dirname(path)):
+            if dir_path == self.root_path:
+                self.request_folder_sizes(QModelIndex(), dir_path)
+            elif dir_path in model.expanded and dir_path in model.loaded:
+                self.request_folder_sizes(model.loaded[dir_path].index(), dir_path)
+
+    def stop_size_threads(self):
+        # 退出前停掉后台计算，QThread 还在运行时被销毁会让进程直接崩溃
+        # 收起时取消的线程可能还没结束，所以按子对象找全
+        threads = self.findChildren(FolderSizeThread)
+        self.size_threads.clear()
+        for thread in threads:
+            thread.cancel()
+        for thread in threads:
+            thread.wait()
+    
+FOLDER_ROLE = Qt.UserRole + 1 # 这一行是不是文件夹
+STATE_ROLE = Qt.UserRole + 2  # None: 还没加载, 'partial': 加载了一部分, 'done': 全部加载完
+
+
+class MyTreeModel(QStandardItemModel):
+    progress = pyqtSignal(str, int, int) # (路径, 已完成字节, 总字节)
+    reloaded = pyqtSignal(str) # 重新列过的目录，视图要重新填文件夹大小
+    PAGE_SIZE = 200 # 每次 fetchMore 加载的行数
+    MEMORY_BUDGET = 256 * 1024 * 1024 # 树里的行超过这个估计值就开始换出收起来的子树
+
+    def __init__(self, root_path = '~', loc='local', parent=None):
+        super().__init__(parent)
+        self.root_path = root_path
+        self.loc = loc
+        # 获取一个统一的单例
+        self.executor = Executor.get_instance(**load_host())
+        # 文件夹大小缓存，一棵树一个
+        self.size_cache = FolderSizeCache()
+        # 还没读完的目录 {path: pager}
+        self.pagers = {}
+        # 已经加载到树里的目录，按最近使用排序 {path: node}，以及每个目录已经加载的 FileInfo
+        self.loaded = OrderedDict()
+        self.listings = {}
+        self.expanded = set()
+        self.row_count = 0
+        self.max_rows = self.MEMORY_BUDGET // ROW_BYTES
+        # 换出去的目录列表
+        self.listing_cache = ListingCache()
         
         self.fileIcon = QIcon('icons/file.png')
         self.folderIcon = QIcon('icons/folder.png')
         self.emptyFolderIcon = QIcon('icons/empty_folder.png')
         
-    def onItemExpand(self, index):
-        node = self.model().itemFromIndex(index)
-        
-        # 要先清空当前节点下面的所有子节点
-        self.model().removeRows(0, node.rowCount(), index)
-        
-        cur_full_path = Utils.get_path_from_index(self.root_path, self.model(), index)
-        # print(f'cur_full_path: {cur_full_path}')
-        self.list_dir(cur_full_path,  node, loc=self.loc, depth=2)
-        
-    
-    def list_dir(self, path, node, loc, depth):
-        logger.debug(f'lisr_dir depth is {depth}')
-        if depth == 0:
-            print('return')
+        self.setHorizontalHeaderLabels(['name', 'type', 'size'])
+        self.invisibleRootItem().setData(True, FOLDER_ROLE)
+
+    def node_from_index(self, index):
+        return self.itemFromIndex(index) if index.isValid() else self.invisibleRootItem()
+
+    def hasChildren(self, parent=QModelIndex()):
+        # 没加载过的文件夹也要显示展开箭头，不再需要塞一个空的子节点
+        node = self.node_from_index(parent)
+        if node is not None and node.data(FOLDER_ROLE) and node.data(STATE_ROLE) != 'done':
+            return True
+        return super().hasChildren(parent)
+
+    def canFetchMore(self, parent):
+        node = self.node_from_index(parent)
+        return node is not None and bool(node.data(FOLDER_ROLE)) and node.data(STATE_ROLE) != 'done'
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
             return
-        # node为根节点，列出node下面的两级目录
-        a = time.perf_counter()
-        output, errors = self.executor.execute_command(f'ls -alh {path}', loc)
-        b = time.perf_counter()
-        print(f'ls -alh {path} time: {b-a}')
-        a = time.perf_counter()
-        file_infos = self.executor.parse_ls_output(output)
-        b = time.perf_counter()
-        print(f'parse_ls_output time: {b-a}')
-        
-        if len(file_infos) <= 3: # 文件夹下面是空的
-            node.setIcon(self.emptyFolderIcon) # 添加空文件夹标志
-            
+        path = Utils.get_path_from_index(self.root_path, self, parent) if parent.isValid() else self.root_path
+        self.list_dir(path, self.node_from_index(parent))
+
+    def list_dir(self, path, node):
+        # 每次只加载一页，视图滚动到底部时会再调用 fetchMore
+        if self.loc == 'remote':
+            # 列目录是交互操作，不用和传输一起排队
+            self.executor.limiter.acquire(self.executor.hostname, 4096, interactive=True)
         a = time.perf_counter()
-        # self.setUpdatesEnabled(False)
-        for i, file_info in enumerate(file_infos[3:]):
-            # print(file_info)
-            self.add_file_info(path, node, file_info, loc, depth)
-            if i % 100 == 99:
-                QApplication.processEvents()
-        # self.setUpdatesEnabled(True)
+        pager = self.pagers.get(path)
+        try:
+            if pager is None:
+                # 换出去的目录优先从缓存里恢复，不用再列一次
+                cached = self.listing_cache.pop(path)
+                pager = ListPager(cached) if cached is not None else self.executor.open_dir(path, self.loc)
+                self.pagers[path] = pager
+            file_infos = pager.next_page(self.PAGE_SIZE)
+        except Exception as e:
+            logger.error(f'list_dir {path} 失败: {e}')
+            self.pagers.pop(path, None)
+            node.setData('done', STATE_ROLE)
+            return
         b = time.perf_counter()
-        print(f'add_file_info time: {b-a}')
-                    
-        
-    def add_file_info(self, path, node, file_info, loc, depth):
+        if logconfig.enabled('DEBUG'):
+            logger.debug(f'list_dir {path}: {len(file_infos)} 项, {b - a:.3f}s')
+
+        if pager.exhausted:
+            pager.close()
+            del self.pagers[path]
+            node.setData('done', STATE_ROLE)
+            if node.rowCount() == 0 and not file_infos and node is not self.invisibleRootItem(): # 文件夹下面是空的
+                node.setIcon(self.emptyFolderIcon) # 添加空文件夹标志
+        else:
+            node.setData('partial', STATE_ROLE)
+
+        for file_info in file_infos:
+            self.add_file_info(path, node, file_info)
+        self.listings.setdefault(path, []).extend(file_infos)
+        self.row_count += len(file_infos)
+        self.loaded[path] = node
+        self.loaded.move_to_end(path)
+        self.enforce_budget(path)
+
+    def set_expanded(self, path, expanded):
+        if expanded:
+            self.expanded.add(path)
+            if path in self.loaded:
+                self.loaded.move_to_end(path)
+        else:
+            self.expanded.discard(path)
+            self.enforce_budget()
+
+    def enforce_budget(self, keep=None):
+        # 超出预算时从最久没用过的目录开始，把收起来的子树换出去，降到预算的 80% 为止
+        # keep 是正在加载的目录，它和它的祖先都不能换出
+        if self.row_count <= self.max_rows:
+            return
+        for path in list(self.loaded):
+            if self.row_count <= self.max_rows * 0.8:
+                break
+            if path not in self.loaded or path in self.expanded:
+                continue
+            if keep is not None and (keep == path or keep.startswith(path.rstrip('/') + '/')):
+                continue
+            if self.loaded[path] is self.invisibleRootItem():
+                continue
+            self.evict(path)
+
+    def unload(self, path, keep_listing=False):
+        # 删掉 path 下面所有的行，节点恢复成还没加载的状态，下次 fetchMore 时重新加载
+        # keep_listing=True 时读完了的列表放进紧凑缓存，否则连缓存一起丢掉
+        # path 自己的展开状态不变：视图里它还是展开的，只有被删掉的子目录不再展开
+        node = self.loaded.get(path)
+        if node is None:
+            return None
+        prefix = path.rstrip('/') + '/'
+        for sub_path in [p for p in self.loaded if p == path or p.startswith(prefix)]:
+            del self.loaded[sub_path]
+            if sub_path != path:
+                self.expanded.discard(sub_path)
+            file_infos = self.listings.pop(sub_path, [])
+            self.row_count -= len(file_infos)
+            pager = self.pagers.pop(sub_path, None)
+            if pager is not None:
+                pager.close()
+            elif keep_listing:
+                self.listing_cache.put(sub_path, file_infos)
+            if not keep_listing:
+                self.listing_cache.discard(sub_path)
+        node.removeRows(0, node.rowCount())
+        node.setData(None, STATE_ROLE)
+        if node is not self.invisibleRootItem():
+            node.setIcon(self.folderIcon)
+        return node
+
+    def evict(self, path):
+        # 换出：读完了的列表放进紧凑缓存，没读完的下次重新列
+        self.unload(path, keep_listing=True)
+        if logconfig.enabled('DEBUG'):
+            logger.debug(f'换出 {path}, 树里还有 {self.row_count} 行')
+
+    def reload(self, path):
+        # 目录的内容变了（拖放、移动之后）：展开着的马上重新列，收起来的等下次展开再列
+        self.listing_cache.discard(path)
+        visible = path == self.root_path or path in self.expanded
+        node = self.unload(path)
+        if node is not None and visible:
+            self.fetchMore(node.index())
+        self.reloaded.emit(path)
+
+    def memory_usage(self):
+        # (树里的行数, 这些行估计占用的字节, 紧凑缓存估计占用的字节)
+        return self.row_count, self.row_count * (ROW_BYTES + INFO_BYTES), self.listing_cache.nbytes
+
+    def add_file_info(self, path, node, file_info):
         name = file_info.name
         size = file_info.size
         file_type = file_info.file_type
@@ -296,29 +325,18 @@ class FileTreeView(QTreeView):
         typeItem = QStandardItem(file_type)
         typeItem.setEditable(False)
         if file_info.file_type == 'folder':
-            sizeItem = QStandardItem('--') # 文件夹不显示大小
+            # 文件夹大小算过的话直接显示
+            folder_size = self.size_cache.get(os.path.join(path, name))
+            sizeItem = QStandardItem('--' if folder_size is None else Utils.format_size(folder_size))
         else:
-            sizeItem = QStandardItem(size)
+            sizeItem = QStandardItem(Utils.format_size(size))
         sizeItem.setEditable(False)
-        node.appendRow([nameItem, typeItem, sizeItem])
         if file_info.file_type == 'folder':
             nameItem.setIcon(self.folderIcon)
-            nameItem.appendRow(QStandardItem()) # 添加一个空的子节点
-            # self.list_dir(path+'/'+file_info.name, nameItem, type, depth-1)
+            nameItem.setData(True, FOLDER_ROLE)
         else:
             nameItem.setIcon(self.fileIcon)
-        
-        
-
-class MyTreeModel(QStandardItemModel):
-    def __init__(self, root_path = '~', loc='local', parent=None):
-        super().__init__(parent)
-        self.root_path = root_path
-        self.loc = loc
-        # 获取一个统一的单例
-        self.executor = Executor.get_instance(hostname='', port=22, username='', password='')
-        
-        self.setHorizontalHeaderLabels(['name', 'type', 'size'])
+        node.appendRow([nameItem, typeItem, sizeItem])
 
     def mimeTypes(self):
         return ['fileDesc']
@@ -331,21 +349,25 @@ class MyTreeModel(QStandardItemModel):
     def mimeData(self, indexes):
         try:
             mime_data = QMimeData()
-            send_message = {}
-            for index in indexes: # 事实上只应该有一个
-                # print(self.itemFromIndex(index).text())
-                # print(index.row(), index.column())
-                if index.isValid():
-                    logger.debug('index is valid')
-                    send_message['file_name'] = self.itemFromIndex(index).text()
-            send_message['from_where'] = self.loc # 用来标识是从哪里来的
-            send_message['full_path'] = Utils.get_path_from_index(root_path = self.root_path, 
-                                                    model = self, 
-                                                    index = indexes[0]) # 用来标识文件的完整路径
-            # print('hello:', self.columnData(indexes[0], indexes[0].row(), 1))
-            send_message = str(send_message).encode()
-            mime_data.setData('fileDesc', send_message)
-            # print(mime_data.data('fileDesc').data().decode())
+            sources = []
+            rows = set()
+            for index in indexes: # 每一行的每一列都会传进来，只取第0列
+                if not index.isValid():
+                    continue
+                index = index.sibling(index.row(), 0)
+                key = (index.row(), QPersistentModelIndex(index.parent()))
+                if key in rows:
+                    continue
+                rows.add(key)
+                sources.append({
+                    'file_name': self.itemFromIndex(index).text(),
+                    'full_path': Utils.get_path_from_index(root_path = self.root_path, model = self, index = index), # 用来标识文件的完整路径
+                })
+            send_message = {
+                'from_where': self.loc, # 用来标识是从哪里来的
+                'sources': sources,
+            }
+            mime_data.setData('fileDesc', json.dumps(send_message).encode())
         except Exception as e:
             logger.error(e)
             return None
@@ -359,33 +381,66 @@ class MyTreeModel(QStandardItemModel):
             logger.debug('action is ignore')
             return False
         
-        send_message = eval(data.data('fileDesc').data().decode()) # str --> dict
-        # for key in send_message.keys():
-        #     logger.debug(f'key: {key}, value: {send_message[key]}')
-        from_path = send_message['full_path']
-        to_path = Utils.get_path_from_index(root_path = self.root_path, model=self, index=parent) + '/' + send_message['file_name']
-        # to_path = Utils.get_path_from_index(root_path = self.root_path, model=self, index=parent) + '/'
+        try:
+            send_message = json.loads(data.data('fileDesc').data().decode()) # str --> dict
+        except ValueError as e:
+            logger.error(f'invalid fileDesc: {e}')
+            return False
+        # print(row, parent.row()) # 这两个不一样啊
+        if parent.isValid() and not self.itemFromIndex(parent.sibling(parent.row(), 0)).data(FOLDER_ROLE):
+            print('not a folder')
+            return False
 
+        to_dir = Utils.get_path_from_index(root_path = self.root_path, model=self, index=parent) if parent.isValid() else self.root_path
+        items = [(source['full_path'], to_dir + '/' + source['file_name']) for source in send_message['sources']]
+        if not items:
+            return False
         from_loc = send_message['from_where']
         to_loc = self.loc
         
+        progress = lambda done, total: self.report_progress(to_dir, done, total)
+        # 同一棵树里按住 shift 拖动是移动，其他情况都是复制
+        move = action == Qt.MoveAction and from_loc == to_loc
         
-        # print(row, parent.row()) # 这两个不一样啊
-        if self.itemFromIndex(parent.sibling(parent.row(), 1)).text() == 'folder':
+        # 整批源作为一个任务，一次规划、并行传输
+        errors = []
+        # 这里是 C++ 虚函数的 Python 实现，异常漏出去 PyQt 会直接结束进程
+        try:
             if from_loc == 'local' and to_loc == 'remote':
-                self.executor.upload(from_path, to_path)
-            if from_loc == 'local' and to_loc == 'local':
-                self.executor.execute_command(f'cp -r {from_path} {to_path}', 'local')
+                errors = self.executor.transfer('upload', items, progress)
             if from_loc == 'remote' and to_loc == 'local':
-                self.executor.download(from_path, to_path)
+                errors = self.executor.transfer('download', items, progress)
+            if from_loc == 'local' and to_loc == 'local':
+                if move:
+                    errors = self.executor.local_move_many(items, progress)
+                else:
+                    errors = self.executor.copy_engine.copy_many(items, progress)
             if from_loc == 'remote' and to_loc == 'remote':
-                self.executor.execute_command(f'cp -r {from_path} {to_path}', 'remote')
-        else:
-            print('not a folder')
-            return False
+                if move:
+                    errors = self.executor.remote_move_many(items, progress)
+                else:
+                    errors = self.executor.remote_copy_many(items, progress)
+        except Exception as e:
+            logger.error(f'{from_loc} -> {to_loc} 失败 {to_dir}: {e}')
+            errors.append((to_dir, e))
+        # 目标文件夹和移动的源文件夹的内容变了，下次展开时重新计算它们的大小
+        self.size_cache.mark_dirty(to_dir)
+        # 已经加载过的目标目录和移动的源目录要重新列，否则新文件一直不会出现
+        self.reload(to_dir)
+        if move:
+            for parent in {os.path.dirname(from_path) for from_path, _ in items}:
+                self.size_cache.mark_dirty(parent)
+                self.reload(parent)
             
-        return True
+        return not errors
     
+    def supportedDropActions(self):
+        return Qt.CopyAction | Qt.MoveAction
+
+    def report_progress(self, path, done, total):
+        self.progress.emit(path, done, total)
+        QApplication.processEvents()
+
     def flags(self, index):
         if index.column() == 0:
             return Qt.ItemIsSelectable | Qt.ItemIsEditable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled | Qt.ItemIsDropEnabled
@@ -408,6 +463,13 @@ class FileManager(QMainWindow):
         self.eidtLine1.setText(local_root_path)
         self.eidtLine2 = QLineEdit()
         self.eidtLine2.setText(remote_root_path)
+
+        # 限速，单位 KB/s，0 表示不限速，传输过程中也可以修改
+        self.rateLabel = QLabel('限速 (KB/s):')
+        self.rateSpinBox = QSpinBox()
+        self.rateSpinBox.setRange(0, 10 * 1024 * 1024)
+        self.rateSpinBox.setSpecialValueText('不限速')
+        self.rateSpinBox.valueChanged.connect(lambda value: default_limiter.set_global_rate(value * 1024))
         
         self.tree_view1 = FileTreeView(root_path=local_root_path, loc='local')
         self.tree_model1 = MyTreeModel(root_path=self.tree_view1.root_path, loc='local')
@@ -434,19 +496,92 @@ class FileManager(QMainWindow):
         right_layout.addWidget(self.eidtLine2)
         right_layout.addWidget(self.tree_view2)
             
-        layout = QHBoxLayout()
-        layout.addLayout(left_layout)
-        layout.addLayout(right_layout)
+        self.tree_model1.progress.connect(self.onProgress)
+        self.tree_model2.progress.connect(self.onProgress)
+        self.tree_model1.reloaded.connect(self.tree_view1.on_reloaded)
+        self.tree_model2.reloaded.connect(self.tree_view2.on_reloaded)
+
+        # 双击远程文件时在下面预览
+        self.preview = PreviewWidget()
+        self.tree_view2.doubleClicked.connect(self.onRemoteDoubleClick)
+            
+        rate_layout = QHBoxLayout()
+        rate_layout.addStretch(1)
+        rate_layout.addWidget(self.rateLabel)
+        rate_layout.addWidget(self.rateSpinBox)
+
+        tree_layout = QHBoxLayout()
+        tree_layout.addLayout(left_layout)
+        tree_layout.addLayout(right_layout)
+        layout = QVBoxLayout()
+        layout.addLayout(rate_layout)
+        layout.addLayout(tree_layout, 3)
+        layout.addWidget(self.preview, 1)
         container = QWidget()
         container.setLayout(layout)
         self.setCentralWidget(container)
         
-        self.tree_view1.list_dir(local_root_path, self.tree_model1, 'local', 2)
-        self.tree_view2.list_dir(remote_root_path, self.tree_model2, 'remote', 2)
+        # 根目录先加载第一页，后面的由视图按需 fetchMore
+        self.tree_model1.fetchMore(QModelIndex())
+        self.tree_model2.fetchMore(QModelIndex())
+        self.tree_view1.request_folder_sizes(QModelIndex(), local_root_path)
+        self.tree_view2.request_folder_sizes(QModelIndex(), remote_root_path)
+        # 窗口显示出来之后再检查有没有上次没完成的任务
+        QTimer.singleShot(0, self.offerResume)
+
+        # 状态栏右边显示内存占用
+        self.memoryLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.memoryLabel)
+        self.memoryTimer = QTimer(self)
+        self.memoryTimer.timeout.connect(self.updateMemory)
+        self.memoryTimer.start(2000)
+        self.updateMemory()
+
+    def updateMemory(self):
+        rows, tree_bytes, cache_bytes = 0, 0, 0
+        for model in (self.tree_model1, self.tree_model2):
+            r, t, c = model.memory_usage()
+            rows, tree_bytes, cache_bytes = rows + r, tree_bytes + t, cache_bytes + c
+        self.memoryLabel.setText(f'内存 {Utils.format_size(process_rss())} | 树 {rows} 行 ~{Utils.format_size(tree_bytes)} | 缓存 ~{Utils.format_size(cache_bytes)}')
+
+    def offerResume(self):
+        executor = self.tree_view2.executor
+        jobs = executor.journal.unfinished_jobs(executor.hostname)
+        if not jobs:
+            return
+        reply = QMessageBox.question(self, '未完成的任务', f'发现 {len(jobs)} 个上次没有完成的传输任务，是否继续？')
+        for job_id, direction, host, items in jobs:
+            if reply != QMessageBox.Yes:
+                executor.journal.discard_job(job_id)
+                continue
+            target = os.path.dirname(items[0][1]) if items else ''
+            executor.resume(job_id, direction, items, progress=lambda done, total, path=target: self.resumeProgress(path, done, total))
+
+    def resumeProgress(self, path, done, total):
+        self.onProgress(path, done, total)
+        QApplication.processEvents()
+
+    def onRemoteDoubleClick(self, index):
+        type_item = self.tree_model2.itemFromIndex(index.sibling(index.row(), 1))
+        if type_item is None or type_item.text() == 'folder':
+            return
+        full_path = Utils.get_path_from_index(self.tree_view2.root_path, self.tree_model2, index)
+        self.preview.open(self.tree_view2.executor.sftp, full_path)
+
+    def onProgress(self, path, done, total):
+        percent = done * 100 // total if total else 100
+        self.statusBar().showMessage(f'{path}: {Utils.format_size(done)}/{Utils.format_size(total)} ({percent}%)')
+
+    def closeEvent(self, a0: QCloseEvent) -> None:
+        self.tree_view1.stop_size_threads()
+        self.tree_view2.stop_size_threads()
+        self.preview.close_file()
+        self.tree_view2.executor.journal.flush()
+        return super().closeEvent(a0)
         
 
 if __name__ == '__main__':
-    
+    logconfig.setup_logging()
     app = QApplication(sys.argv)
     file_manager = FileManager()
     file_manager.show()
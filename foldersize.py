@@ -0,0 +1,161 @@
+import os, shlex, threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QThread, pyqtSignal
+import logconfig
+import manifest
+import loguru
+
+logger = loguru.logger
+
+
+class FolderSizeCache:
+    # 按目录缓存递归大小（字节），一次计算会把整棵子树的结果都存下来
+    def __init__(self):
+        self._sizes = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _norm(path):
+        return os.path.normpath(path)
+
+    def get(self, path):
+        path = self._norm(path)
+        with self._lock:
+            if path in self._dirty:
+                return None
+            return self._sizes.get(path)
+
+    def known(self, path):
+        # 算过这个目录，结果可能已经过期
+        with self._lock:
+            return self._norm(path) in self._sizes
+
+    def mark_dirty(self, path):
+        # 子节点发生了变化，下次展开时只重新计算这一棵子树
+        with self._lock:
+            self._dirty.add(self._norm(path))
+
+    def apply_delta(self, path, delta):
+        # 已知变化量时直接向上累加，不需要重新扫描
+        path = self._norm(path)
+        with self._lock:
+            while True:
+                if path in self._sizes:
+                    self._sizes[path] += delta
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    def replace_subtree(self, path, sizes):
+        # sizes 是 {目录: 递归大小}，包含 path 本身
+        path = self._norm(path)
+        with self._lock:
+            old = self._sizes.get(path)
+            for sub_path, size in sizes.items():
+                sub_path = self._norm(sub_path)
+                self._sizes[sub_path] = size
+                self._dirty.discard(sub_path)
+            new = self._sizes.get(path)
+            # 祖先节点的结果里已经包含了旧值，只需要补上差值
+            parent = os.path.dirname(path)
+            if old is not None and new is not None and new != old and parent != path:
+                self.apply_delta(parent, new - old)
+
+
+def _scan_one(path):
+    files_size = 0
+    sub_dirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.path)
+                    st = entry.stat(follow_symlinks=False)
+                    # 和 du 一样统计实际占用的磁盘空间
+                    files_size += getattr(st, 'st_blocks', 0) * 512 or st.st_size
+                except OSError:
+                    continue
+    except OSError as e:
+        if logconfig.enabled('DEBUG'):
+            logger.debug(f'scandir {path} 失败: {e}')
+    return path, files_size, sub_dirs
+
+
+def local_tree_sizes(root, cancel_event, workers=8):
+    # 按层并行 scandir，最后自底向上汇总
+    own = {}
+    parent = {}
+    order = []
+    level = [root]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            if cancel_event.is_set():
+                return None
+            next_level = []
+            for path, files_size, sub_dirs in pool.map(_scan_one, level):
+                own[path] = files_size
+                order.append(path)
+                for sub_dir in sub_dirs:
+                    parent[sub_dir] = path
+                    next_level.append(sub_dir)
+            level = next_level
+    totals = dict(own)
+    for path in reversed(order):
+        parent_path = parent.get(path)
+        if parent_path is not None:
+            totals[parent_path] += totals[path]
+    return totals
+
+
+def remote_tree_sizes(ssh, root, cancel_event):
+    # 服务器端一次 find 拿到整棵子树的清单再汇总，服务器不支持时退回到 du
+    try:
+        return manifest.tree_sizes(root, manifest.find_entries(ssh, root, cancel_event), cancel_event)
+    except manifest.FindUnsupported:
+        return du_tree_sizes(ssh, root, cancel_event)
+
+
+def du_tree_sizes(ssh, root, cancel_event):
+    # 服务器端一次 du 得到整棵子树每个目录的大小
+    stdin, stdout, stderr = ssh.exec_command(f'du -k {shlex.quote(root)}')
+    channel = stdout.channel
+    totals = {}
+    for line in stdout:
+        if cancel_event.is_set():
+            channel.close()
+            return None
+        size, _, path = line.rstrip('\n').partition('\t')
+        if path and size.isdigit():
+            totals[path] = int(size) * 1024
+    if channel.recv_exit_status() != 0:
+        logger.debug(f'du {root}: {stderr.read().decode().strip()}')
+    return totals
+
+
+class FolderSizeThread(QThread):
+    sizes_ready = pyqtSignal(str, dict)
+
+    def __init__(self, path, loc, ssh=None, parent=None):
+        super(FolderSizeThread, self).__init__(parent)
+        self.path = path
+        self.loc = loc
+        self.ssh = ssh
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            if self.loc == 'remote':
+                totals = remote_tree_sizes(self.ssh, self.path, self.cancel_event)
+            else:
+                totals = local_tree_sizes(self.path, self.cancel_event)
+        except Exception as e:
+            logger.error(f'计算文件夹大小失败 {self.path}: {e}')
+            return
+        if totals is not None and not self.cancel_event.is_set():
+            self.sizes_ready.emit(self.path, totals)
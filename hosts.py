@@ -0,0 +1,32 @@
+import os, json
+
+HOSTS_FILE = os.path.expanduser('~/.easysftp/hosts.json')
+
+# 环境变量优先于配置文件，cron 和 CI 里不用把密码写进文件
+ENV_KEYS = {'hostname': 'EASYSFTP_HOST', 'port': 'EASYSFTP_PORT',
+            'username': 'EASYSFTP_USER', 'password': 'EASYSFTP_PASSWORD', 'rate': 'EASYSFTP_RATE'}
+
+
+def load_host(name=None, path=HOSTS_FILE):
+    # hosts.json: {"名字": {"hostname": ..., "port": 22, "username": ..., "password": ..., "rate": 0}}
+    # rate 是这台主机的限速，单位 KB/s，0 表示不限速
+    # 不指定名字时用 EASYSFTP_PROFILE，再没有就用 default
+    settings = {'hostname': '', 'port': 22, 'username': '', 'password': '', 'rate': 0}
+    try:
+        with open(path) as f:
+            hosts = json.load(f)
+    except FileNotFoundError:
+        hosts = {}
+    if name is None:
+        profile = hosts.get(os.environ.get('EASYSFTP_PROFILE', 'default'), {})
+    elif name in hosts:
+        profile = hosts[name]
+    else:
+        raise KeyError(f'{path} 里没有主机 {name}')
+    settings.update({key: profile[key] for key in settings if key in profile})
+    for key, env in ENV_KEYS.items():
+        if env in os.environ:
+            settings[key] = os.environ[env]
+    settings['port'] = int(settings['port'])
+    settings['rate'] = int(settings['rate'])
+    return settings
@@ -0,0 +1,108 @@
+import os, json, time, sqlite3, threading
+import loguru
+
+logger = loguru.logger
+
+JOURNAL_FILE = os.path.expanduser('~/.easysftp/journal.db')
+
+PLANNED, ACTIVE, DONE = 'planned', 'active', 'done'
+
+
+class TransferJournal:
+    # 记录每个任务计划传输的文件和已经完成的偏移量，程序崩溃后可以从断点继续
+    # 状态更新先合并在内存里，攒够一批或者超过 flush_interval 才写一次数据库
+    def __init__(self, path=JOURNAL_FILE, batch_size=1000, flush_interval=1.0):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                direction TEXT NOT NULL,
+                host TEXT NOT NULL,
+                items TEXT NOT NULL,
+                state TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                job_id INTEGER NOT NULL,
+                src TEXT NOT NULL,
+                dst TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                offset INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                PRIMARY KEY (job_id, src)
+            );
+        ''')
+        self.db.commit()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}  # {(job_id, src): (offset, state)}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start_job(self, direction, host, items, files):
+        # files: [(源文件, 目标文件, 大小)]，整个计划在一个事务里写入
+        with self._lock:
+            cur = self.db.execute('INSERT INTO jobs (direction, host, items, state, created) VALUES (?, ?, ?, ?, ?)',
+                                  (direction, host, json.dumps(items), ACTIVE, time.time()))
+            job_id = cur.lastrowid
+            self.db.executemany('INSERT OR REPLACE INTO files (job_id, src, dst, size, offset, state) VALUES (?, ?, ?, ?, 0, ?)',
+                                [(job_id, src, dst, size, PLANNED) for src, dst, size in files])
+            self.db.commit()
+        return job_id
+
+    def update(self, job_id, src, offset, state=ACTIVE):
+        with self._lock:
+            self._pending[(job_id, src)] = (offset, state)
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self.db.executemany('UPDATE files SET offset = ?, state = ? WHERE job_id = ? AND src = ?',
+                                [(offset, state, job_id, src) for (job_id, src), (offset, state) in self._pending.items()])
+            self.db.commit()
+            self._pending.clear()
+        self._last_flush = time.monotonic()
+
+    def finish_job(self, job_id):
+        # 完成的任务不需要再保留文件列表
+        with self._lock:
+            self._flush()
+            self.db.execute('DELETE FROM files WHERE job_id = ?', (job_id,))
+            self.db.execute('UPDATE jobs SET state = ? WHERE id = ?', (DONE, job_id))
+            self.db.commit()
+
+    def discard_job(self, job_id):
+        with self._lock:
+            self.db.execute('DELETE FROM files WHERE job_id = ?', (job_id,))
+            self.db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            self.db.commit()
+
+    def unfinished_jobs(self, host=None):
+        # 返回 [(job_id, direction, host, items)]
+        with self._lock:
+            sql = 'SELECT id, direction, host, items FROM jobs WHERE state != ?'
+            args = [DONE]
+            if host is not None:
+                sql += ' AND host = ?'
+                args.append(host)
+            rows = self.db.execute(sql, args).fetchall()
+        return [(job_id, direction, job_host, json.loads(items)) for job_id, direction, job_host, items in rows]
+
+    def job_files(self, job_id):
+        # 返回 [(源文件, 目标文件, 大小, 偏移量, 状态)]
+        with self._lock:
+            return self.db.execute('SELECT src, dst, size, offset, state FROM files WHERE job_id = ?', (job_id,)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.db.close()
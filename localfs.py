@@ -0,0 +1,90 @@
+import os, pwd, grp
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import loguru
+
+logger = loguru.logger
+
+# 这些文件系统上每次 stat 都是一次网络往返，值得并行
+NETWORK_FS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', 'sshfs', '9p', 'afpfs',
+              'davfs', 'fuse.davfs2', 'ceph', 'glusterfs', 'fuse.glusterfs', 'lustre'}
+
+
+@lru_cache(maxsize=None)
+def owner_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@lru_cache(maxsize=None)
+def group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def fs_type(path):
+    # 在 /proc/mounts 里找挂载点最长的那一项，没有 /proc 的系统返回空字符串
+    path = os.path.realpath(path)
+    best, best_type = '', ''
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best):
+                    best, best_type = mount_point, fields[2]
+    except OSError:
+        pass
+    return best_type
+
+
+def _stat_entry(entry):
+    # DirEntry 会缓存 stat 的结果；断开的符号链接退回到 lstat
+    try:
+        return entry.name, entry.stat()
+    except OSError:
+        try:
+            return entry.name, entry.stat(follow_symlinks=False)
+        except OSError:
+            return entry.name, None
+
+
+class LocalDirPager:
+    # 用 os.scandir 分页读取本地目录，不再 fork 一个 ls 进程
+    # next_page 返回 [(文件名, stat_result)]；网络文件系统上用线程池并行 stat
+    def __init__(self, path, workers=16):
+        self.path = path
+        self.iterator = os.scandir(path)
+        self.done = False
+        self.pool = ThreadPoolExecutor(max_workers=workers) if fs_type(path) in NETWORK_FS else None
+
+    @property
+    def exhausted(self):
+        return self.done
+
+    def next_page(self, count):
+        entries = []
+        for entry in self.iterator:
+            entries.append(entry)
+            if len(entries) >= count:
+                break
+        else:
+            self.close()
+        if self.pool is not None:
+            results = list(self.pool.map(_stat_entry, entries))
+        else:
+            results = [_stat_entry(entry) for entry in entries]
+        return [(name, st) for name, st in results if st is not None]
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.iterator.close()
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
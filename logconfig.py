@@ -0,0 +1,55 @@
+import os, sys, time, threading
+import loguru
+from ratelimit import TokenBucket
+
+logger = loguru.logger
+
+LEVELS = {'TRACE': 5, 'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+# 当前生效的最低级别，默认和 loguru 自带的 stderr sink 一样是 DEBUG
+min_level = LEVELS['DEBUG']
+
+
+# 热点路径上先判断一下，关掉的日志连 f-string 都不用格式化
+def enabled(level):
+    return LEVELS[level] >= min_level
+
+
+class CallSiteLimiter:
+    # 每个调用位置 (文件, 行号) 一个令牌桶，每秒最多 rate 条，超出的丢掉并计数，
+    # 这个位置下一条放行的日志后面附上被丢掉的条数；ERROR 及以上不限制
+    def __init__(self, rate=20, burst=50):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.dropped = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        if record['level'].no >= LEVELS['ERROR']:
+            return True
+        site = (record['file'].path, record['line'])
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get(site)
+            if bucket is None:
+                bucket = self.buckets[site] = TokenBucket(self.rate, self.burst)
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                self.dropped[site] = self.dropped.get(site, 0) + 1
+                return False
+            bucket.tokens -= 1
+            dropped = self.dropped.pop(site, 0)
+        if dropped:
+            record['message'] += f' (这里还有 {dropped} 条日志被省略)'
+        return True
+
+
+def setup_logging(level=None, sink=sys.stderr, rate=20, burst=50):
+    # enqueue=True 时日志先放进队列，由后台线程写出，传输线程不用等 IO
+    # 不指定级别时用环境变量 EASYSFTP_LOG_LEVEL，默认 INFO
+    global min_level
+    level = (level or os.environ.get('EASYSFTP_LOG_LEVEL', 'INFO')).upper()
+    min_level = LEVELS[level]
+    logger.remove()
+    logger.add(sink, level=level, enqueue=True, filter=CallSiteLimiter(rate, burst))
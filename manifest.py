@@ -0,0 +1,120 @@
+import posixpath, shlex, stat, threading, weakref
+from paramiko import SSHException
+from paramiko.sftp_attr import SFTPAttributes
+import loguru
+
+logger = loguru.logger
+
+# 类型 权限 大小 占用的块数 修改时间 相对路径，再跟着符号链接指向的路径（不是链接时为空），
+# 两项都以 \0 结尾，文件名里有空格和换行也没关系
+# -H 让作为参数的 root 是符号链接时也能跟进去，和 sftp opendir 的行为一致；下面的链接不跟进去，原样列出
+FIND_COMMAND = "find -H {root} -mindepth 1 -printf '%y %m %s %b %T@ %P\\0%l\\0'"
+# 只用来判断服务器上的 find 支不支持 -printf，不碰任何用户目录
+PRINTF_PROBE = "find / -maxdepth 0 -printf x"
+
+FIND_TYPE_BITS = {'f': stat.S_IFREG, 'd': stat.S_IFDIR, 'l': stat.S_IFLNK, 'c': stat.S_IFCHR,
+                  'b': stat.S_IFBLK, 'p': stat.S_IFIFO, 's': stat.S_IFSOCK}
+
+
+class FindUnsupported(Exception):
+    # 服务器上没有 GNU find（BSD、busybox）或者不允许执行命令，调用方应该退回到 sftp 遍历
+    pass
+
+
+_printf_support = weakref.WeakKeyDictionary()  # {SSHClient: bool}，每个连接只探测一次
+
+
+def supports_printf(ssh):
+    if ssh not in _printf_support:
+        try:
+            stdin, stdout, stderr = ssh.exec_command(PRINTF_PROBE)
+            output = stdout.read()
+            supported = stdout.channel.recv_exit_status() == 0 and output == b'x'
+        except SSHException as e:
+            logger.debug(f'find -printf 探测失败: {e}')
+            supported = False
+        _printf_support[ssh] = supported
+    return _printf_support[ssh]
+
+
+def parse_record(root, record, link=b''):
+    kind, mode, size, blocks, mtime, rel_path = record.split(b' ', 5)
+    attr = SFTPAttributes()
+    if kind == b'l':
+        # 和 walker.walk 一样，符号链接带上它指向的路径，调用方按链接处理，不当成普通文件
+        attr.link_target = link.decode('utf-8', 'replace')
+    attr.filename = posixpath.basename(rel_path.decode('utf-8', 'replace'))
+    attr.st_mode = FIND_TYPE_BITS.get(kind.decode(), stat.S_IFREG) | int(mode, 8)
+    attr.st_size = int(size)
+    attr.st_mtime = int(float(mtime))
+    attr.st_blocks = int(blocks)  # 512 字节的块，统计文件夹大小时用
+    return posixpath.join(root, rel_path.decode('utf-8', 'replace')), attr
+
+
+def find_entries(ssh, root, cancel_event=None, chunk_size=256 * 1024):
+    # 在服务器上执行一次 find，边接收边解析，yield (完整路径, SFTPAttributes)
+    # 服务器不支持时在产生任何条目之前抛出 FindUnsupported
+    # root 不存在或者没有权限这类错误只影响这一次，抛出 IOError
+    if not supports_printf(ssh):
+        raise FindUnsupported('find 不支持 -printf')
+    try:
+        stdin, stdout, stderr = ssh.exec_command(FIND_COMMAND.format(root=shlex.quote(root)))
+    except SSHException as e:
+        raise FindUnsupported(str(e))
+    channel = stdout.channel
+    # 没有权限的子目录多的时候错误输出也很多，在另一个线程里读，否则会填满通道窗口卡住
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(stderr.read()), daemon=True)
+    reader.start()
+    count = 0
+    buffer = b''
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            data = channel.recv(chunk_size)
+            if not data:
+                break
+            fields = (buffer + data).split(b'\0')
+            buffer = fields.pop()
+            if len(fields) % 2:
+                # 一条记录的链接部分还没收到
+                buffer = fields.pop() + b'\0' + buffer
+            for record, link in zip(fields[::2], fields[1::2]):
+                try:
+                    entry = parse_record(root, record, link)
+                except ValueError:
+                    logger.debug(f'find {root}: 无法解析 {record[:100]!r}')
+                    continue
+                count += 1
+                yield entry
+        status = channel.recv_exit_status()
+        if status != 0:
+            reader.join()
+            error = b''.join(errors).decode('utf-8', 'replace').strip()
+            if count == 0:
+                raise IOError(f'find {root} 失败 ({status}): {error}')
+            # 部分子目录没有权限时 find 也会返回非 0，已经列出的结果仍然有效
+            logger.debug(f'find {root} 退出码 {status}，共 {count} 项: {error}')
+    finally:
+        channel.close()
+
+
+def tree_sizes(root, entries, cancel_event=None):
+    # 把清单汇总成 {目录: 递归大小}，和 du 一样按占用的磁盘空间统计，包含 root 本身
+    root = posixpath.normpath(root)
+    totals = {root: 0}
+    for path, attr in entries:
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        size = attr.st_blocks * 512 if hasattr(attr, 'st_blocks') else attr.st_size or 0
+        if stat.S_ISDIR(attr.st_mode):
+            # du 把目录自己占的块也算在里面
+            totals[path] = totals.get(path, 0) + size
+        parent = posixpath.dirname(path)
+        while True:
+            totals[parent] = totals.get(parent, 0) + size
+            if parent == root or parent == posixpath.dirname(parent):
+                break
+            parent = posixpath.dirname(parent)
+    return totals
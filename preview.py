@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QScrollBar, QPushButton, QLabel, QHBoxLayout, QVBoxLayout
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QTextCursor
+import loguru
+
+logger = loguru.logger
+
+
+class RangedReader:
+    # 通过 sftp 按块读取远程文件，带预读和 LRU 缓存，不会下载整个文件
+    def __init__(self, sftp, path, block_size=64 * 1024, cache_blocks=64, read_ahead=4):
+        self.path = path
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.read_ahead = read_ahead
+        self.file = sftp.open(path, 'rb')
+        self.size = self.file.stat().st_size
+        self.blocks = OrderedDict()  # {块号: bytes}
+        self.transferred = 0  # 实际传输的字节数
+
+    @property
+    def block_count(self):
+        return (self.size + self.block_size - 1) // self.block_size
+
+    def _fetch(self, block_ids):
+        missing = [i for i in block_ids if i not in self.blocks]
+        if not missing:
+            return
+        chunks = [(i * self.block_size, min(self.block_size, self.size - i * self.block_size)) for i in missing]
+        # readv 会把所有请求一次性发出去，只花一个往返
+        for i, data in zip(missing, self.file.readv(chunks)):
+            self.blocks[i] = data
+            self.transferred += len(data)
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+
+    def read(self, offset, length):
+        if offset >= self.size or length <= 0:
+            return b''
+        length = min(length, self.size - offset)
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        ahead = min(last + self.read_ahead, self.block_count - 1)
+        self._fetch(range(first, ahead + 1))
+        parts = []
+        for i in range(first, last + 1):
+            self.blocks.move_to_end(i)
+            parts.append(self.blocks[i])
+        start = offset - first * self.block_size
+        return b''.join(parts)[start:start + length]
+
+    def head(self, length):
+        return self.read(0, length)
+
+    def tail(self, length):
+        return self.read(max(0, self.size - length), length)
+
+    def close(self):
+        self.file.close()
+        self.blocks.clear()
+
+
+class PreviewWidget(QWidget):
+    # 远程文件预览，滚动条的位置对应文件里的块号
+    def __init__(self, page_blocks=2, parent=None):
+        super(PreviewWidget, self).__init__(parent)
+        self.reader = None
+        self.page_blocks = page_blocks
+
+        self.label = QLabel()
+        self.headButton = QPushButton('Head')
+        self.tailButton = QPushButton('Tail')
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.scrollBar = QScrollBar(Qt.Vertical)
+
+        self.headButton.clicked.connect(lambda: self.scrollBar.setValue(0))
+        self.tailButton.clicked.connect(lambda: self.scrollBar.setValue(self.scrollBar.maximum()))
+        self.scrollBar.valueChanged.connect(self.show_block)
+
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(self.label, 1)
+        top_layout.addWidget(self.headButton)
+        top_layout.addWidget(self.tailButton)
+        text_layout = QHBoxLayout()
+        text_layout.addWidget(self.text)
+        text_layout.addWidget(self.scrollBar)
+        layout = QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addLayout(text_layout)
+        self.setLayout(layout)
+
+    def open(self, sftp, path):
+        self.close_file()
+        try:
+            self.reader = RangedReader(sftp, path)
+        except Exception as e:
+            logger.error(f'打开 {path} 失败: {e}')
+            self.label.setText(str(e))
+            return
+        self.scrollBar.blockSignals(True)
+        self.scrollBar.setRange(0, max(0, self.reader.block_count - self.page_blocks))
+        self.scrollBar.setValue(0)
+        self.scrollBar.blockSignals(False)
+        self.show_block(0)
+
+    def show_block(self, block_id):
+        if self.reader is None:
+            return
+        block_size = self.reader.block_size
+        data = self.reader.read(block_id * block_size, self.page_blocks * block_size)
+        self.text.setPlainText(data.decode('utf-8', errors='replace'))
+        if block_id == self.scrollBar.maximum() and block_id > 0:
+            self.text.moveCursor(QTextCursor.End)
+        self.label.setText(f'{self.reader.path}  {block_id * block_size}/{self.reader.size}  '
+                           f'(已传输 {self.reader.transferred} 字节)')
+
+    def close_file(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
@@ -0,0 +1,105 @@
+import time, threading, itertools
+from collections import deque
+
+
+class TokenBucket:
+    # rate 单位是字节/秒，0 表示不限速
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    @property
+    def capacity(self):
+        return self.burst or max(self.rate / 4, 64 * 1024)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.capacity)
+        self.last = now
+
+    def set_rate(self, rate, now):
+        self.refill(now)
+        self.rate = rate
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class RateLimiter:
+    # 全局和每台主机两级令牌桶
+    # 批量传输按先来后到排队，每次只拿一小块，多个传输之间自然轮转，公平分享带宽
+    # 列目录、stat 这类交互操作不排队，并且最近有交互操作时批量传输只能用 (1 - reserve) 的带宽
+    QUANTUM = 64 * 1024
+
+    def __init__(self, global_rate=0, reserve=0.1):
+        self.global_bucket = TokenBucket(global_rate)
+        self.host_buckets = {}
+        self.reserve = reserve
+        self.last_interactive = 0
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._tickets = itertools.count()
+
+    def set_global_rate(self, rate):
+        with self._cond:
+            self.global_bucket.set_rate(rate, time.monotonic())
+            self._cond.notify_all()
+
+    def set_host_rate(self, host, rate):
+        with self._cond:
+            bucket = self.host_buckets.setdefault(host, TokenBucket(0))
+            bucket.set_rate(rate, time.monotonic())
+            self._cond.notify_all()
+
+    def _buckets(self, host):
+        buckets = [self.global_bucket]
+        if host in self.host_buckets:
+            buckets.append(self.host_buckets[host])
+        return [b for b in buckets if b.rate]
+
+    def acquire(self, host, nbytes, interactive=False):
+        if interactive:
+            with self._cond:
+                now = time.monotonic()
+                self.last_interactive = now
+                for bucket in self._buckets(host):
+                    bucket.refill(now)
+                    bucket.tokens -= nbytes
+            return
+        if not self._buckets(host):
+            return
+        while nbytes > 0:
+            n = min(nbytes, self.QUANTUM)
+            self._acquire_bulk(host, n)
+            nbytes -= n
+
+    def _acquire_bulk(self, host, nbytes):
+        with self._cond:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] == ticket:
+                        now = time.monotonic()
+                        cost = nbytes
+                        if now - self.last_interactive < 2 and self.reserve < 1:
+                            cost = nbytes / (1 - self.reserve)
+                        deficit = 0
+                        for bucket in self._buckets(host):
+                            bucket.refill(now)
+                            deficit = max(deficit, (min(cost, bucket.capacity) - bucket.tokens) / bucket.rate)
+                        if deficit <= 0:
+                            for bucket in self._buckets(host):
+                                bucket.tokens -= cost
+                            return
+                        # 限速被修改时会被唤醒重新计算
+                        timeout = deficit
+                    self._cond.wait(timeout)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+
+# 所有连接共用一个限速器，这样全局限速才有意义
+default_limiter = RateLimiter()
@@ -0,0 +1,210 @@
+import posixpath, shlex, stat, threading
+from paramiko.sftp import CMD_EXTENDED, CMD_STATUS, SFTP_OK, SFTP_OP_UNSUPPORTED, int64
+from transfercore import AsyncResponses, wait_response
+import walker
+import loguru
+
+logger = loguru.logger
+
+
+class RemoteOps:
+    # 服务器端的复制/移动，数据不经过客户端
+    # 优先用 sftp 扩展 (posix-rename, hardlink, copy-data)，不支持时退回到 exec 并监控进度
+    def __init__(self, ssh, sftp, walk, chunk_size=64 * 1024 * 1024):
+        self.ssh = ssh
+        self.sftp = sftp
+        self.walk = walk  # Executor.walk_remote，一次拿到整棵树的清单
+        self.chunk_size = chunk_size
+        self.unsupported = set()  # 服务器不支持的扩展
+
+    def _extended(self, name, *args):
+        if name in self.unsupported:
+            return False
+        # 自己看状态码：只有 OP_UNSUPPORTED 才说明服务器不支持，
+        # 其他失败（目标已存在、磁盘满）照常抛出 IOError
+        responses = AsyncResponses()
+        num = self.sftp._async_request(responses, CMD_EXTENDED, name, *args)
+        t, msg = wait_response(self.sftp, responses, num)
+        if t != CMD_STATUS:
+            return True
+        code = msg.get_int()
+        if code == SFTP_OK:
+            return True
+        if code == SFTP_OP_UNSUPPORTED:
+            logger.debug(f'服务器不支持 {name}')
+            self.unsupported.add(name)
+            return False
+        msg.rewind()
+        msg.get_int()  # 请求号
+        self.sftp._convert_status(msg)
+        raise IOError(f'{name} 失败')
+
+    def hardlink(self, src, dst):
+        return self._extended('hardlink@openssh.com', src, dst)
+
+    def copy_data(self, src, dst, progress=None):
+        with self.sftp.open(src, 'rb') as fsrc, self.sftp.open(dst, 'wb') as fdst:
+            size = fsrc.stat().st_size
+            offset = 0
+            while True:
+                length = min(self.chunk_size, size - offset)
+                # 长度为 0 表示一直复制到文件末尾，空文件也要走一次
+                if not self._extended('copy-data', fsrc.handle, int64(offset), int64(length),
+                                      fdst.handle, int64(offset)):
+                    return False
+                offset += length
+                if progress is not None:
+                    progress(length)
+                if offset >= size:
+                    break
+        self.sftp.chmod(dst, stat.S_IMODE(self.sftp.stat(src).st_mode))
+        return True
+
+    def plan(self, src, dst, attr):
+        # attr 是 src 的 stat 结果，返回 (要创建的目录, [(源文件, 目标文件, 大小)], [(目标路径, 链接指向的路径)])
+        # 清单里的属性是 lstat 的，符号链接和 cp -r 一样原样复制，指回祖先目录的链接不会无限递归
+        if not stat.S_ISDIR(attr.st_mode):
+            return [], [(src, dst, attr.st_size)], []
+        dirs, files, links = [dst], [], []
+        for path, attr in self.walk(src):
+            sub_dst = posixpath.join(dst, posixpath.relpath(path, src))
+            if stat.S_ISDIR(attr.st_mode):
+                dirs.append(sub_dst)
+            elif stat.S_ISLNK(attr.st_mode):
+                target = getattr(attr, 'link_target', None)
+                if target is None:
+                    logger.warning(f'读不到符号链接 {path} 指向的路径, 跳过')
+                else:
+                    links.append((sub_dst, target))
+            else:
+                files.append((path, sub_dst, attr.st_size))
+        return dirs, files, links
+
+    def symlink(self, target, link_path):
+        # 已经有一样的链接时不算失败，复制进已有的同名文件夹时会遇到
+        try:
+            self.sftp.symlink(target, link_path)
+        except IOError:
+            try:
+                if self.sftp.readlink(link_path) == target:
+                    return
+            except IOError:
+                pass
+            raise
+
+    def copy(self, src, dst, progress=None, link=False):
+        return self.copy_many([(src, dst)], progress, link)
+
+    def copy_many(self, items, progress=None, link=False):
+        # 多个源作为一个任务：stat 一次流水线发出去，一起规划，进度按总字节算
+        # progress(已完成字节, 总字节)，link=True 时用硬链接代替复制
+        attrs = walker.stat_many(self.sftp, [src for src, _ in items])
+        plans = [(src, dst) + self.plan(src, dst, attr) for (src, dst), attr in zip(items, attrs)]
+        dirs = [d for plan in plans for d in plan[2]]
+        files = [f for plan in plans for f in plan[3]]
+        links = [l for plan in plans for l in plan[4]]
+        total = sum(size for _, _, size in files)
+        done = 0
+
+        def on_chunk(n):
+            nonlocal done
+            done += n
+            if progress is not None:
+                progress(done, total)
+
+        # 已经存在的目录不用再建，复制进已有的同名文件夹时不会失败
+        walker.mkdirs(self.sftp, dirs)
+        for file_src, file_dst, size in files:
+            ok = self.hardlink(file_src, file_dst) if link else self.copy_data(file_src, file_dst, on_chunk)
+            if not ok:
+                # 扩展不可用，剩下的交给服务器上的 cp；目录已经建好了，所以复制的是 src/.
+                errors = []
+                for src, dst, item_dirs, item_files, _ in plans:
+                    copy_src = posixpath.join(src, '.') if item_dirs else src
+                    item_total = sum(size for _, _, size in item_files)
+                    errors += self.exec_copy(copy_src, dst, progress, item_total, extra='-l' if link else '')
+                return errors
+            if link:
+                on_chunk(size)
+        # 退回到 cp 时链接由 cp 复制，所以放在最后
+        errors = []
+        for link_path, target in links:
+            try:
+                self.symlink(target, link_path)
+            except IOError as e:
+                logger.error(f'创建符号链接 {link_path} 失败: {e}')
+                errors.append((link_path, e))
+        return errors
+
+    def move_many(self, items, progress=None):
+        # 所有 posix-rename 一次流水线发出去，失败的再逐个走 move 的退路
+        rest = items
+        if 'posix-rename@openssh.com' not in self.unsupported:
+            responses = AsyncResponses()
+            requests = [(self.sftp._async_request(responses, CMD_EXTENDED, 'posix-rename@openssh.com', src, dst), src, dst)
+                        for src, dst in items]
+            rest = []
+            for num, src, dst in requests:
+                t, msg = wait_response(self.sftp, responses, num)
+                code = msg.get_int() if t == CMD_STATUS else None
+                if code == SFTP_OK:
+                    continue
+                if code == SFTP_OP_UNSUPPORTED:
+                    self.unsupported.add('posix-rename@openssh.com')
+                rest.append((src, dst))
+        errors = []
+        for src, dst in rest:
+            # 一项失败不影响其他项
+            try:
+                errors += self.move(src, dst, progress)
+            except IOError as e:
+                logger.error(f'移动失败 {src}: {e}')
+                errors.append((src, e))
+        return errors
+
+    def move(self, src, dst, progress=None):
+        try:
+            self.sftp.posix_rename(src, dst)
+            return []
+        except IOError as e:
+            logger.debug(f'posix_rename {src} 失败: {e}')
+        # 没有 posix-rename 时用硬链接再删除源文件，至少不会覆盖已有文件
+        if not stat.S_ISDIR(self.sftp.stat(src).st_mode) and self.hardlink(src, dst):
+            self.sftp.remove(src)
+            return []
+        return self.exec_command_checked(f'mv -- {shlex.quote(src)} {shlex.quote(dst)}')
+
+    def exec_copy(self, src, dst, progress=None, total=0, extra=''):
+        # cp -v 每复制一个文件输出一行，按行数估算进度
+        count_cmd = f'find {shlex.quote(src)} -type f 2>/dev/null | wc -l'
+        stdin, stdout, stderr = self.ssh.exec_command(count_cmd)
+        file_count = int(stdout.read().decode().strip() or 0)
+        cmd = f'cp -Rpv {extra} -- {shlex.quote(src)} {shlex.quote(dst)}'
+        copied = 0
+
+        def on_line(line):
+            nonlocal copied
+            copied += 1
+            if progress is not None and file_count:
+                progress(min(copied, file_count) * total // file_count, total)
+
+        return self.exec_command_checked(cmd, on_line)
+
+    def exec_command_checked(self, command, on_line=None):
+        # 逐行读取输出，最后检查退出码
+        # stderr 在另一个线程里同时读，否则错误输出多的时候会填满通道窗口卡住
+        logger.debug(f'remote exec: {command}')
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        errors = []
+        reader = threading.Thread(target=lambda: errors.append(stderr.read()), daemon=True)
+        reader.start()
+        for line in stdout:
+            if on_line is not None:
+                on_line(line)
+        exit_status = stdout.channel.recv_exit_status()
+        reader.join()
+        if exit_status != 0:
+            error = b''.join(errors).decode(errors='replace').strip()
+            logger.error(f'{command} 失败 ({exit_status}): {error}')
+            return [(command, error)]
+        return []
@@ -0,0 +1,65 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copyengine import LocalCopyEngine
+
+
+def make_tree(root):
+    os.makedirs(root / 'sub' / 'empty')
+    (root / 'a.bin').write_bytes(os.urandom(300000))
+    (root / 'sub' / 'b.txt').write_text('hello')
+    os.symlink('sub/b.txt', root / 'link')
+    os.symlink('..', root / 'sub' / 'up')
+
+
+def test_copy_many_copies_files_dirs_and_links(tmp_path):
+    src = tmp_path / 'src'
+    make_tree(src)
+    (tmp_path / 'other.txt').write_text('other')
+    dst = tmp_path / 'dst'
+    dst.mkdir()
+    progress = []
+
+    errors = LocalCopyEngine(workers=2).copy_many(
+        [(str(src), str(dst / 'src')), (str(tmp_path / 'other.txt'), str(dst / 'other.txt'))],
+        lambda done, total: progress.append((done, total)))
+
+    assert errors == []
+    assert (dst / 'src' / 'a.bin').read_bytes() == (src / 'a.bin').read_bytes()
+    assert (dst / 'src' / 'sub' / 'b.txt').read_text() == 'hello'
+    assert (dst / 'src' / 'sub' / 'empty').is_dir()
+    assert (dst / 'other.txt').read_text() == 'other'
+    # 符号链接原样复制，指回上层的链接不会被跟进去
+    assert os.readlink(dst / 'src' / 'link') == 'sub/b.txt'
+    assert os.readlink(dst / 'src' / 'sub' / 'up') == '..'
+    assert progress[-1] == (300010, 300010)
+
+
+def test_copy_into_existing_folder(tmp_path):
+    src = tmp_path / 'src'
+    make_tree(src)
+    dst = tmp_path / 'dst'
+    os.makedirs(dst / 'sub')
+    (dst / 'keep.txt').write_text('keep')
+
+    assert LocalCopyEngine().copy(str(src), str(dst)) == []
+    assert (dst / 'keep.txt').read_text() == 'keep'
+    assert (dst / 'sub' / 'b.txt').read_text() == 'hello'
+
+
+def test_move_many_renames_and_reports_each_failure(tmp_path):
+    src = tmp_path / 'src'
+    make_tree(src)
+    dst = tmp_path / 'dst'
+    dst.mkdir()
+
+    errors = LocalCopyEngine().move_many([(str(src / 'sub'), str(dst / 'sub')),
+                                          (str(tmp_path / 'missing'), str(dst / 'missing')),
+                                          (str(src / 'a.bin'), str(dst / 'a.bin'))])
+
+    # 一项失败不影响其他项
+    assert [path for path, _ in errors] == [str(tmp_path / 'missing')]
+    assert not (src / 'sub').exists() and not (src / 'a.bin').exists()
+    assert (dst / 'sub' / 'b.txt').read_text() == 'hello'
+    assert (dst / 'a.bin').stat().st_size == 300000
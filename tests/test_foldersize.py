@@ -0,0 +1,50 @@
+import os, sys, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from foldersize import FolderSizeCache, local_tree_sizes
+
+
+def test_replace_subtree_propagates_the_difference_to_ancestors():
+    cache = FolderSizeCache()
+    cache.replace_subtree('/a', {'/a': 100, '/a/b': 40, '/a/b/c': 10, '/a/d': 30})
+    cache.mark_dirty('/a/b')
+    assert cache.get('/a/b') is None
+    assert cache.known('/a/b')
+    assert cache.get('/a') == 100
+
+    cache.replace_subtree('/a/b', {'/a/b': 60, '/a/b/c': 25})
+    assert cache.get('/a/b') == 60
+    assert cache.get('/a/b/c') == 25
+    assert cache.get('/a') == 120
+    assert cache.get('/a/d') == 30
+
+
+def test_new_subtree_does_not_change_ancestors():
+    # 以前没算过的目录没有旧值，祖先目录要等它自己变脏重算
+    cache = FolderSizeCache()
+    cache.replace_subtree('/a', {'/a': 100})
+    cache.replace_subtree('/a/new', {'/a/new': 50})
+    assert cache.get('/a') == 100
+    assert not cache.known('/a/other')
+
+
+def test_apply_delta_walks_up_to_the_root():
+    cache = FolderSizeCache()
+    cache.replace_subtree('/', {'/': 1000, '/a': 100, '/a/b': 10})
+    cache.apply_delta('/a/b', 5)
+    assert (cache.get('/'), cache.get('/a'), cache.get('/a/b')) == (1005, 105, 15)
+
+
+def test_local_tree_sizes(tmp_path):
+    os.makedirs(tmp_path / 'a' / 'b')
+    (tmp_path / 'a' / 'b' / 'f').write_bytes(os.urandom(50000))
+    (tmp_path / 'g').write_bytes(os.urandom(10000))
+    totals = local_tree_sizes(str(tmp_path), threading.Event())
+    assert totals[str(tmp_path / 'a' / 'b')] >= 50000
+    assert totals[str(tmp_path / 'a')] >= totals[str(tmp_path / 'a' / 'b')]
+    assert totals[str(tmp_path)] >= totals[str(tmp_path / 'a')] + 10000
+
+    cancelled = threading.Event()
+    cancelled.set()
+    assert local_tree_sizes(str(tmp_path), cancelled) is None
@@ -0,0 +1,58 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import TransferJournal, PLANNED, ACTIVE, DONE
+from transferjob import TransferJob
+
+
+class FakeExecutor:
+    def __init__(self, journal):
+        self.journal = journal
+
+
+def test_updates_are_batched_until_flush(tmp_path):
+    journal = TransferJournal(str(tmp_path / 'journal.db'), batch_size=100, flush_interval=3600)
+    job_id = journal.start_job('download', 'host', [['/r', '/l']], [('/r/a', '/l/a', 10), ('/r/b', '/l/b', 20)])
+    assert sorted(journal.job_files(job_id)) == [('/r/a', '/l/a', 10, 0, PLANNED), ('/r/b', '/l/b', 20, 0, PLANNED)]
+
+    journal.update(job_id, '/r/a', 4)
+    journal.update(job_id, '/r/a', 8)
+    # 还在内存里，同一个文件只保留最后一次
+    assert journal.job_files(job_id)[0][3] == 0
+    journal.flush()
+    assert sorted(journal.job_files(job_id))[0] == ('/r/a', '/l/a', 10, 8, ACTIVE)
+    journal.close()
+
+
+def test_batch_size_triggers_a_write(tmp_path):
+    journal = TransferJournal(str(tmp_path / 'journal.db'), batch_size=2, flush_interval=3600)
+    job_id = journal.start_job('upload', 'host', [], [('/a', '/r/a', 10), ('/b', '/r/b', 10)])
+    journal.update(job_id, '/a', 5)
+    journal.update(job_id, '/b', 10, DONE)
+    assert sorted(state for *_, state in journal.job_files(job_id)) == [ACTIVE, DONE]
+    journal.close()
+
+
+def test_resume_skips_done_files_and_keeps_offsets(tmp_path):
+    path = str(tmp_path / 'journal.db')
+    journal = TransferJournal(path)
+    files = [('/r/a', '/l/x/a', 10), ('/r/b', '/l/y/b', 20), ('/r/c', '/l/y/c', 30)]
+    job_id = journal.start_job('download', 'host', [['/r', '/l']], files)
+    journal.update(job_id, '/r/a', 10, DONE)
+    journal.update(job_id, '/r/b', 7, ACTIVE)
+    # 模拟程序退出：没有 finish_job
+    journal.close()
+
+    journal = TransferJournal(path)
+    assert journal.unfinished_jobs('host') == [(job_id, 'download', 'host', [['/r', '/l']])]
+    assert journal.unfinished_jobs('other') == []
+    job = TransferJob.resume(FakeExecutor(journal), job_id, 'download', [['/r', '/l']])
+    assert sorted(job.files) == [('/r/b', '/l/y/b', 20), ('/r/c', '/l/y/c', 30)]
+    assert job.offsets == {'/r/b': 7}
+    assert job.dirs == ['/l/y']
+
+    journal.finish_job(job_id)
+    assert journal.unfinished_jobs() == []
+    assert journal.job_files(job_id) == []
+    journal.close()
@@ -0,0 +1,99 @@
+import os, sys, stat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import manifest
+from manifest import parse_record, tree_sizes, find_entries
+
+
+class FakeChannel:
+    def __init__(self, chunks, status):
+        self.chunks = list(chunks)
+        self.status = status
+
+    def recv(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        pass
+
+
+class FakeStream:
+    def __init__(self, channel, data=b''):
+        self.channel = channel
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeSSH:
+    # 探测命令回答 x，find 的输出按给定的块返回
+    def __init__(self, chunks, status=0, error=b''):
+        self.chunks = chunks
+        self.status = status
+        self.error = error
+        self.commands = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        if command == manifest.PRINTF_PROBE:
+            channel = FakeChannel([], 0)
+            return None, FakeStream(channel, b'x'), FakeStream(channel)
+        channel = FakeChannel(self.chunks, self.status)
+        return None, FakeStream(channel), FakeStream(channel, self.error)
+
+
+def test_parse_record():
+    path, attr = parse_record('/root', b'f 644 1234 8 1700000000.5 dir/name with space')
+    assert path == '/root/dir/name with space'
+    assert attr.filename == 'name with space'
+    assert stat.S_ISREG(attr.st_mode) and stat.S_IMODE(attr.st_mode) == 0o644
+    assert (attr.st_size, attr.st_blocks, attr.st_mtime) == (1234, 8, 1700000000)
+    assert not hasattr(attr, 'link_target')
+
+    path, attr = parse_record('/root', b'l 777 5 0 1700000000.0 up', b'..')
+    assert stat.S_ISLNK(attr.st_mode)
+    assert attr.link_target == '..'
+
+
+def test_tree_sizes_counts_blocks_like_du():
+    entries = [parse_record('/r', record) for record in (
+        b'd 755 4096 8 0 a',
+        b'f 644 100 8 0 a/x',
+        b'd 755 4096 8 0 a/b',
+        b'f 644 5000 16 0 a/b/y',
+        b'f 644 10 8 0 z',
+    )]
+    totals = tree_sizes('/r/', entries)
+    assert totals['/r/a/b'] == (8 + 16) * 512
+    assert totals['/r/a'] == (8 + 8 + 8 + 16) * 512
+    assert totals['/r'] == (8 + 8 + 8 + 16 + 8) * 512
+
+
+def test_find_entries_handles_records_split_across_reads():
+    output = b'f 644 3 8 0 a b\0\0l 777 2 0 0 up\0..\0d 755 4096 8 0 dir\0\0'
+    # 在记录中间、记录和链接之间都断开
+    ssh = FakeSSH([output[:5], output[5:16], output[16:32], output[32:40], output[40:]])
+    entries = list(find_entries(ssh, '/r'))
+    assert [path for path, _ in entries] == ['/r/a b', '/r/up', '/r/dir']
+    assert entries[1][1].link_target == '..'
+    # 每个连接只探测一次
+    list(find_entries(ssh, '/r'))
+    assert ssh.commands.count(manifest.PRINTF_PROBE) == 1
+
+
+def test_find_failure_on_one_root_is_an_error_not_unsupported():
+    ssh = FakeSSH([], status=1, error=b"find: '/gone': No such file or directory")
+    try:
+        list(find_entries(ssh, '/gone'))
+    except manifest.FindUnsupported:
+        assert False, 'root 不存在不代表服务器不支持'
+    except IOError as e:
+        assert 'No such file' in str(e)
+    else:
+        assert False
+    assert manifest.supports_printf(ssh)
@@ -0,0 +1,61 @@
+import os, sys, time, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+def test_unlimited_and_interactive_never_wait():
+    limiter = RateLimiter()
+    start = time.monotonic()
+    limiter.acquire('h', 100 * 1024 * 1024)
+    limiter.set_global_rate(1024)
+    # 交互操作只扣令牌，不排队
+    limiter.acquire('h', 10 * 1024 * 1024, interactive=True)
+    assert time.monotonic() - start < 0.5
+    assert limiter.global_bucket.tokens < 0
+
+
+def test_host_rate_only_limits_that_host():
+    limiter = RateLimiter()
+    limiter.set_host_rate('slow', 1024)
+    start = time.monotonic()
+    limiter.acquire('fast', 10 * 1024 * 1024)
+    assert time.monotonic() - start < 0.5
+    assert limiter._buckets('slow') == [limiter.host_buckets['slow']]
+    assert limiter._buckets('fast') == []
+
+
+def test_changing_the_rate_wakes_waiting_transfers():
+    limiter = RateLimiter(global_rate=1024)
+    # 第一块用掉初始的令牌，第二块按 1KB/s 要等一分钟
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (limiter.acquire('h', 2 * RateLimiter.QUANTUM), done.set()), daemon=True)
+    worker.start()
+    time.sleep(0.2)
+    assert not done.is_set()
+    limiter.set_global_rate(0)
+    assert done.wait(2)
+
+
+def test_bulk_transfers_share_bandwidth_in_turn():
+    limiter = RateLimiter()
+    # 没有突发额度，每一块都要排队等令牌
+    limiter.global_bucket = TokenBucket(32 * RateLimiter.QUANTUM, burst=RateLimiter.QUANTUM)
+    grants = []
+    lock = threading.Lock()
+
+    def transfer(name):
+        for _ in range(10):
+            limiter.acquire('h', RateLimiter.QUANTUM)
+            with lock:
+                grants.append(name)
+
+    workers = [threading.Thread(target=transfer, args=(name,)) for name in 'ab']
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+    assert sorted(grants) == ['a'] * 10 + ['b'] * 10
+    # 先来后到轮流拿，任何一方都不会在另一方只拿到几块的时候就传完
+    assert 3 <= grants[:10].count('a') <= 7
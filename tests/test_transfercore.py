@@ -0,0 +1,143 @@
+import os, sys, itertools
+from paramiko.message import Message
+from paramiko.sftp import CMD_READ, CMD_DATA, CMD_WRITE, CMD_STATUS, SFTP_OK
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfercore import TransferTuner, pipelined_get, pipelined_put
+
+
+class FakeFile:
+    def __init__(self, size):
+        self.size = size
+        self.handle = b'h'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def stat(self):
+        return os.stat_result((0, 0, 0, 0, 0, 0, self.size, 0, 0, 0))
+
+
+class WriteFile(FakeFile):
+    def __init__(self, sftp):
+        super().__init__(0)
+        self.sftp = sftp
+
+    def truncate(self, size):
+        del self.sftp.data[size:]
+        self.sftp.data.extend(bytes(size - len(self.sftp.data)))
+
+
+class WriteSFTP:
+    # 把写请求直接写进内存，记下真正发送的字节数
+    def __init__(self):
+        self.data = bytearray()
+        self.sent = 0
+        self.pending = []
+        self.numbers = itertools.count()
+
+    def open(self, path, mode):
+        return WriteFile(self)
+
+    def stat(self, path):
+        return FakeFile(len(self.data)).stat()
+
+    def _async_request(self, fileobj, t, handle, offset, data):
+        assert t == CMD_WRITE
+        offset = int(offset)
+        self.truncate_to(offset + len(data))
+        self.data[offset:offset + len(data)] = data
+        self.sent += len(data)
+        num = next(self.numbers)
+        self.pending.append((num, fileobj))
+        return num
+
+    def truncate_to(self, size):
+        if len(self.data) < size:
+            self.data.extend(bytes(size - len(self.data)))
+
+    def _read_response(self):
+        num, fileobj = self.pending.pop(0)
+        msg = Message()
+        msg.add_int(SFTP_OK)
+        msg.add_string('')
+        msg.add_string('')
+        msg.rewind()
+        fileobj._async_response(CMD_STATUS, msg, num)
+
+    def _convert_status(self, msg):
+        assert msg.get_int() == SFTP_OK
+
+
+class ShortReadSFTP:
+    # 每次最多返回 max_read 字节，并且按请求的相反顺序回复
+    def __init__(self, data, max_read):
+        self.data = data
+        self.max_read = max_read
+        self.pending = []
+        self.numbers = itertools.count()
+
+    def open(self, path, mode):
+        return FakeFile(len(self.data))
+
+    def _async_request(self, fileobj, t, handle, offset, length):
+        assert t == CMD_READ
+        num = next(self.numbers)
+        self.pending.append((num, fileobj, int(offset), length))
+        return num
+
+    def _read_response(self):
+        num, fileobj, offset, length = self.pending.pop()
+        msg = Message()
+        msg.add_string(self.data[offset:offset + min(length, self.max_read)])
+        msg.rewind()
+        fileobj._async_response(CMD_DATA, msg, num)
+
+
+def test_committed_offset_never_passes_unwritten_data(tmp_path):
+    data = os.urandom(1024 * 1024 + 12345)
+    local_path = tmp_path / 'out.bin'
+    tuner = TransferTuner('fake', path=str(tmp_path / 'tuning.json'))
+    tuner.request_size = 131072
+    tuner.window = 8
+    committed = []
+
+    def on_chunk(n, offset, sent):
+        # 日志里记下的偏移量之前的数据必须已经在磁盘上
+        with open(local_path, 'rb') as f:
+            assert f.read(offset) == data[:offset]
+        committed.append(offset)
+
+    pipelined_get(ShortReadSFTP(data, 100000), '/remote', str(local_path), tuner, callback=on_chunk)
+
+    assert committed == sorted(committed)
+    assert committed[-1] == len(data)
+    assert local_path.read_bytes() == data
+
+
+def test_skipped_holes_count_as_progress_but_not_as_sent(tmp_path):
+    data = os.urandom(100000)
+    size = 16 * 1024 * 1024
+    local_path = tmp_path / 'sparse.bin'
+    with open(local_path, 'wb') as f:
+        f.seek(size // 2)
+        f.write(data)
+        f.truncate(size)
+    tuner = TransferTuner('fake', path=str(tmp_path / 'tuning.json'))
+    tuner.request_size = 32768
+    tuner.window = 8
+    sftp = WriteSFTP()
+    progress = []
+    sent = []
+
+    pipelined_put(sftp, str(local_path), '/remote', tuner, callback=lambda n, offset, s: (progress.append(n), sent.append(s)))
+
+    assert sum(progress) == size
+    assert sum(sent) == sftp.sent
+    # 只有有数据的那一段走了网络，块的边界可能多带一点 0
+    assert sftp.sent < len(data) + 2 * 65536
+    assert bytes(sftp.data) == local_path.read_bytes()
@@ -0,0 +1,306 @@
+import os, errno, json, math, time, heapq, threading
+from collections import deque
+from paramiko.sftp import CMD_READ, CMD_WRITE, CMD_DATA, CMD_STATUS, CMD_EXTENDED, CMD_EXTENDED_REPLY, int64
+from paramiko import SFTPClient
+import loguru
+
+logger = loguru.logger
+
+TUNING_FILE = os.path.expanduser('~/.easysftp/tuning.json')
+
+
+class TransferTuner:
+    # 根据 RTT 和实测吞吐量调整每个请求的大小和同时在途的请求数，结果按主机保存
+    MIN_REQUEST, MAX_REQUEST = 32 * 1024, 256 * 1024
+    # OpenSSH 的 sftp-server 一次最多读 255KB，整个消息（包括头）超过 256KB 会直接断开会话
+    MAX_READ = 255 * 1024
+    MAX_PACKET = 256 * 1024
+    WRITE_OVERHEAD = 1024  # 写请求的头：长度、类型、请求号、handle、偏移量、数据长度
+    MIN_WINDOW, MAX_WINDOW = 4, 512
+    MIN_CHANNEL_WINDOW, MAX_CHANNEL_WINDOW = 2 * 1024 * 1024, 256 * 1024 * 1024
+
+    def __init__(self, host, path=TUNING_FILE):
+        self.host = host
+        self.path = path
+        self.rtt = 0.001
+        self.request_size = self.MIN_REQUEST
+        self.window = 16
+        self.throughput = 0  # 字节/秒
+        self.max_read = self.MAX_READ
+        self.max_write = self.MAX_PACKET - self.WRITE_OVERHEAD
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._since = time.monotonic()
+        self._last_throughput = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f).get(self.host)
+        except (OSError, ValueError):
+            saved = None
+        if saved:
+            self.request_size = saved.get('request_size', self.request_size)
+            self.window = saved.get('window', self.window)
+            self.throughput = saved.get('throughput', self.throughput)
+            self.rtt = saved.get('rtt', self.rtt)
+
+    def save(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.host] = {
+            'request_size': self.request_size,
+            'window': self.window,
+            'throughput': self.throughput,
+            'rtt': self.rtt,
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def measure_rtt(self, sftp, samples=3):
+        # normalize 是最便宜的一次往返
+        rtts = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            sftp.normalize('.')
+            rtts.append(time.perf_counter() - start)
+        self.rtt = max(min(rtts), 0.0001)
+        self._retune()
+        logger.debug(f'{self.host} rtt: {self.rtt * 1000:.1f}ms, request_size: {self.request_size}, window: {self.window}')
+        return self.rtt
+
+    def query_limits(self, sftp):
+        # 服务器支持 limits@openssh.com 时按它返回的上限决定读写请求的大小，0 表示没有限制
+        try:
+            t, msg = sftp._request(CMD_EXTENDED, 'limits@openssh.com')
+        except IOError as e:
+            logger.debug(f'{self.host} 不支持 limits@openssh.com: {e}')
+            return
+        if t != CMD_EXTENDED_REPLY:
+            return
+        max_packet, max_read, max_write = msg.get_int64(), msg.get_int64(), msg.get_int64()
+        if max_read:
+            self.max_read = max_read
+        if max_write:
+            self.max_write = max_write
+        if max_packet:
+            self.max_write = min(self.max_write, max_packet - self.WRITE_OVERHEAD)
+        logger.debug(f'{self.host} limits: max_read {self.max_read}, max_write {self.max_write}')
+
+    @property
+    def read_size(self):
+        return min(self.request_size, self.max_read)
+
+    @property
+    def write_size(self):
+        return min(self.request_size, self.max_write)
+
+    @property
+    def bdp(self):
+        # 带宽时延积，没测过吞吐量时按 1Gbit/s 估计
+        throughput = self.throughput or 125 * 1024 * 1024
+        return throughput * self.rtt
+
+    def channel_window(self):
+        # ssh 通道的窗口也要能容纳在途的数据，否则 sftp 再怎么流水线也没用
+        return int(min(max(2 * self.window * self.request_size, self.MIN_CHANNEL_WINDOW), self.MAX_CHANNEL_WINDOW))
+
+    def _retune(self):
+        # 请求大小随 BDP 增大，让在途请求数保持在合理范围内
+        request_size = self.MIN_REQUEST
+        while request_size < self.MAX_REQUEST and self.bdp / request_size > 64:
+            request_size *= 2
+        self.request_size = request_size
+        need = math.ceil(2 * self.bdp / self.request_size)
+        self.window = min(max(self.window, need, self.MIN_WINDOW), self.MAX_WINDOW)
+
+    def record(self, nbytes):
+        with self._lock:
+            self._bytes += nbytes
+            now = time.monotonic()
+            elapsed = now - self._since
+            if elapsed < max(4 * self.rtt, 0.25):
+                return
+            throughput = self._bytes / elapsed
+            self._bytes = 0
+            self._since = now
+            # 吞吐量还在涨就继续加大窗口，明显下降就退回一点
+            if throughput > self._last_throughput * 1.05:
+                self.window = min(int(self.window * 1.5) + 1, self.MAX_WINDOW)
+            elif throughput < self._last_throughput * 0.8:
+                self.window = max(int(self.window * 0.8), self.MIN_WINDOW)
+            self._last_throughput = throughput
+            self.throughput = self.throughput * 0.7 + throughput * 0.3 if self.throughput else throughput
+            # 窗口至少要能填满两倍的带宽时延积
+            need = math.ceil(2 * self.bdp / self.request_size)
+            self.window = min(max(self.window, need), self.MAX_WINDOW)
+
+    def open_sftp(self, transport):
+        return SFTPClient.from_transport(transport, window_size=self.channel_window(),
+                                         max_packet_size=32768)
+
+
+class AsyncResponses:
+    # 收集异步请求的响应，paramiko 收到响应时会回调 _async_response
+    def __init__(self):
+        self.results = {}
+
+    def _async_response(self, t, msg, num):
+        self.results[num] = (t, msg)
+
+
+def wait_response(sftp, responses, num):
+    while num not in responses.results:
+        sftp._read_response()
+    return responses.results.pop(num)
+
+
+def is_zero(data):
+    # 先看首尾两个字节，大部分有数据的块不用扫描整块
+    return data[0] == 0 and data[-1] == 0 and data.count(0) == len(data)
+
+
+def data_ranges(fd, start, size):
+    # 用 SEEK_DATA/SEEK_HOLE 找出真正有数据的区间，跳过空洞
+    # 不支持的系统和文件系统把整个文件当成一段数据
+    if not hasattr(os, 'SEEK_DATA'):
+        yield start, size
+        return
+    offset = start
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                yield offset, size
+            # ENXIO: 后面全是空洞
+            return
+        if data >= size:
+            return
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        yield data, hole
+        offset = hole
+
+
+def sparse_chunks(fd, start, size, tuner):
+    # 按 tuner.write_size 切块，yield (偏移量, 数据, 长度)，数据为 None 表示这一段全是 0
+    offset = start
+    for data_start, data_end in data_ranges(fd, start, size):
+        if data_start > offset:
+            yield offset, None, data_start - offset
+        offset = data_start
+        while offset < data_end:
+            data = os.pread(fd, min(tuner.write_size, data_end - offset), offset)
+            if not data:
+                # 文件在传输过程中变短了
+                return
+            yield offset, None if is_zero(data) else data, len(data)
+            offset += len(data)
+    if offset < size:
+        yield offset, None, size - offset
+
+
+def pipelined_get(sftp, remote_path, local_path, tuner, callback=None, limiter=None, start=0):
+    # 同时保持 tuner.window 个读请求在途，每个请求 tuner.read_size 字节
+    # 有 limiter 时每发一个请求之前先拿令牌
+    # callback(本次字节数, 已经连续写完的偏移量, 本次实际传输的字节数)，start > 0 时从断点继续
+    # 全是 0 的块不写，最后 truncate 到原来的大小，本地文件就是稀疏的
+    responses = AsyncResponses()
+    with sftp.open(remote_path, 'rb') as f:
+        size = f.stat().st_size
+        with open(local_path, 'r+b' if start else 'wb') as out:
+            inflight = deque()
+            # 还没写完的请求的起始偏移量，最小的那个之前的数据都已经写完了
+            # 补发的请求排在队尾，所以不能用 inflight[0] 当作已完成的位置
+            pending = []
+            finished = set()
+            offset = start
+            while offset < size or inflight:
+                while offset < size and len(inflight) < tuner.window:
+                    n = min(tuner.read_size, size - offset)
+                    if limiter is not None:
+                        limiter.acquire(tuner.host, n)
+                    num = sftp._async_request(responses, CMD_READ, f.handle, int64(offset), int(n))
+                    inflight.append((num, offset, n))
+                    heapq.heappush(pending, offset)
+                    offset += n
+                num, req_offset, n = inflight.popleft()
+                t, msg = wait_response(sftp, responses, num)
+                if t != CMD_DATA:
+                    sftp._convert_status(msg)
+                    raise IOError(f'unexpected response reading {remote_path}')
+                data = msg.get_string()
+                if not data:
+                    raise IOError(f'{remote_path} 在传输过程中变短了')
+                if not is_zero(data):
+                    out.seek(req_offset)
+                    out.write(data)
+                if len(data) < n:
+                    # 服务器可以返回比请求少的数据，剩下的再补一个请求
+                    rest = sftp._async_request(responses, CMD_READ, f.handle, int64(req_offset + len(data)), int(n - len(data)))
+                    inflight.append((rest, req_offset + len(data), n - len(data)))
+                    heapq.heappush(pending, req_offset + len(data))
+                finished.add(req_offset)
+                while pending and pending[0] in finished:
+                    finished.discard(heapq.heappop(pending))
+                tuner.record(len(data))
+                if callback is not None:
+                    # 先把数据交给操作系统，再让调用方把偏移量记进日志
+                    out.flush()
+                    callback(len(data), pending[0] if pending else offset, len(data))
+            out.truncate(size)
+    return size
+
+
+def pipelined_put(sftp, local_path, remote_path, tuner, callback=None, limiter=None, start=0):
+    # 空洞和全是 0 的块不发送，服务器上跳过的部分就是空洞，最后 truncate 补上结尾的空洞
+    # callback 和 pipelined_get 一样，跳过的块算进进度，但实际传输的字节数是 0
+    responses = AsyncResponses()
+    with open(local_path, 'rb') as src, sftp.open(remote_path, 'r+b' if start else 'wb') as f:
+        size = os.fstat(src.fileno()).st_size
+        chunks = sparse_chunks(src.fileno(), start, size, tuner)
+        inflight = deque()
+        offset = start
+        tail_hole = False
+        eof = False
+        while True:
+            while not eof and len(inflight) < tuner.window:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                    break
+                chunk_offset, data, n = chunk
+                num = None
+                if data is not None:
+                    if limiter is not None:
+                        limiter.acquire(tuner.host, n)
+                    num = sftp._async_request(responses, CMD_WRITE, f.handle, int64(chunk_offset), data)
+                # 跳过的块也排队，保证回调里的偏移量是连续完成的
+                inflight.append((num, chunk_offset, n))
+                offset = chunk_offset + n
+                tail_hole = data is None
+            if not inflight:
+                break
+            num, req_offset, n = inflight.popleft()
+            sent = 0
+            if num is not None:
+                t, msg = wait_response(sftp, responses, num)
+                if t != CMD_STATUS:
+                    raise IOError(f'unexpected response writing {remote_path}')
+                sftp._convert_status(msg)
+                tuner.record(n)
+                sent = n
+            if callback is not None:
+                callback(n, inflight[0][1] if inflight else offset, sent)
+        if start or tail_hole:
+            f.truncate(offset)
+    # 和 sftp.put 一样确认一下大小
+    remote_size = sftp.stat(remote_path).st_size
+    if remote_size != offset:
+        raise IOError(f'size mismatch in put! {remote_size} != {offset}')
+    return offset
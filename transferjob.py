@@ -0,0 +1,256 @@
+import os, posixpath, stat, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from journal import ACTIVE, DONE
+import walker
+import logconfig
+import loguru
+
+logger = loguru.logger
+
+
+class TransferJob:
+    # 一次拖放对应一个任务：先把所有源展开成完整的文件列表，
+    # 再在同一个 ssh 连接上开多个 sftp 通道并行传输
+    def __init__(self, executor, direction, items, workers=8):
+        self.executor = executor
+        self.direction = direction  # 'upload' 或 'download'
+        self.items = items  # [(源路径, 目标路径)]
+        self.workers = workers
+        self.dirs = []
+        self.files = []  # [(源文件, 目标文件, 大小)]
+        self.links = []  # 下载时原样在本地重建的符号链接 [(目标路径, 链接指向的路径)]
+        self.mtimes = {}  # 同步时用来比较新旧 {源文件: 修改时间}
+        self.planned = False
+        self.force = False  # 同步剪枝之后留下的文件一定要传，不再按大小判断是否已经存在
+        self.transferred = 0  # 这次真正传输的字节数，不含跳过的文件、断点之前的部分和没有发送的空洞
+        self.skipped = 0
+        self.journal = executor.journal
+        self.job_id = None
+        self.offsets = {}  # 断点续传时每个文件已经完成的偏移量 {源文件: 偏移量}
+        self._done = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._channels = []
+
+    @classmethod
+    def resume(cls, executor, job_id, direction, items):
+        # 从日志恢复一个没完成的任务，已经完成的文件直接跳过，传了一半的从断点继续
+        job = cls(executor, direction, items)
+        job.job_id = job_id
+        for src, dst, size, offset, state in job.journal.job_files(job_id):
+            if state == DONE:
+                continue
+            job.files.append((src, dst, size))
+            if state == ACTIVE:
+                job.offsets[src] = offset
+        # 空目录在第一次运行时就已经建好了，这里只需要保证文件的父目录存在
+        parent = os.path.dirname if direction == 'download' else posixpath.dirname
+        job.dirs = sorted({parent(dst) for _, dst, _ in job.files})
+        job.planned = True
+        return job
+
+    def plan(self):
+        self.dirs, self.files, self.links, self.mtimes = [], [], [], {}
+        if self.direction == 'upload':
+            for src, dst in self.items:
+                self._plan_local(src, dst)
+        else:
+            # 所有源的 stat 一次流水线发出去，不是每个源等一次往返
+            attrs = walker.stat_many(self.executor.sftp, [src for src, _ in self.items])
+            for (src, dst), attr in zip(self.items, attrs):
+                self._plan_remote(src, dst, attr)
+        logger.debug(f'{self.direction}: {len(self.dirs)} 个目录, {len(self.files)} 个文件')
+        self.planned = True
+        return self.dirs, self.files
+
+    def _plan_local(self, src, dst):
+        st = os.stat(src)
+        if not stat.S_ISDIR(st.st_mode):
+            self.files.append((src, dst, st.st_size))
+            self.mtimes[src] = st.st_mtime
+            return
+        self.dirs.append(dst)
+        for entry in os.scandir(src):
+            self._plan_local(entry.path, posixpath.join(dst, entry.name))
+
+    def _plan_remote(self, src, dst, attr):
+        if not stat.S_ISDIR(attr.st_mode):
+            self.files.append((src, dst, attr.st_size))
+            self.mtimes[src] = attr.st_mtime
+            return
+        self.dirs.append(dst)
+        self._plan_remote_dir(src, dst)
+
+    def _plan_remote_dir(self, src, dst):
+        # 整棵树的清单一次拿到，条目里已经带了属性，不用再逐个 stat
+        for sub_src, attr in self.executor.walk_remote(src):
+            sub_dst = os.path.join(dst, posixpath.relpath(sub_src, src))
+            if stat.S_ISDIR(attr.st_mode):
+                self.dirs.append(sub_dst)
+            elif stat.S_ISLNK(attr.st_mode):
+                # 清单里是链接本身，不能当成文件去读；指向目录的链接跟进去还可能绕回祖先目录
+                target = getattr(attr, 'link_target', None)
+                if target is None:
+                    logger.warning(f'读不到符号链接 {sub_src} 指向的路径, 跳过')
+                else:
+                    self.links.append((sub_dst, target))
+            else:
+                self.files.append((sub_src, sub_dst, attr.st_size))
+                self.mtimes[sub_src] = attr.st_mtime
+
+    def prune_unchanged(self):
+        # 同步：目标已经存在、大小一样并且不比源旧的文件不再传输，返回跳过的文件数
+        existing = self._existing_targets()
+        files = []
+        for src, dst, size in self.files:
+            target = existing.get(dst)
+            # sftp 的时间只精确到秒
+            if target is not None and target[0] == size and target[1] >= int(self.mtimes.get(src, 0)):
+                continue
+            files.append((src, dst, size))
+        skipped = len(self.files) - len(files)
+        self.files = files
+        self.force = True
+        return skipped
+
+    def _existing_targets(self):
+        # {目标文件: (大小, 修改时间)}，远程的目标目录一次拿到整棵树的清单，不逐个 stat
+        existing = {}
+        if self.direction == 'download':
+            for _, dst, _ in self.files:
+                try:
+                    st = os.stat(dst)
+                except OSError:
+                    continue
+                existing[dst] = (st.st_size, st.st_mtime)
+            return existing
+        for _, dst in self.items:
+            try:
+                attr = self.executor.sftp.stat(dst)
+            except IOError:
+                continue
+            if not stat.S_ISDIR(attr.st_mode):
+                existing[dst] = (attr.st_size, attr.st_mtime)
+                continue
+            for path, sub in self.executor.walk_remote(dst):
+                existing[path] = (sub.st_size, sub.st_mtime)
+        return existing
+
+    def _sftp(self, compress=False):
+        # 每个工作线程一个 sftp 通道，共用同一个 ssh transport
+        # 需要压缩的文件走另一个开了压缩的 transport
+        channels = getattr(self._local, 'channels', None)
+        if channels is None:
+            channels = self._local.channels = {}
+        sftp = channels.get(compress)
+        if sftp is None:
+            sftp = channels[compress] = self.executor.open_sftp(compress)
+            with self._lock:
+                self._channels.append(sftp)
+        return sftp
+
+    def _make_dirs(self):
+        if self.direction == 'upload':
+            # 所有 mkdir 一次性流水线发出去
+            walker.mkdirs(self.executor.sftp, self.dirs)
+            return
+        for dir_path in self.dirs:
+            self.executor.check_local_dir(dir_path)
+        for dst, target in self.links:
+            if os.path.islink(dst):
+                if os.readlink(dst) == target:
+                    continue
+                os.remove(dst)
+            os.symlink(target, dst)
+
+    def _transfer_one(self, src, dst, size):
+        sftp = self._sftp(self.executor.should_compress(self.direction, src, size, self._sftp()))
+        start = self.offsets.get(src, 0)
+        if start and self._partial_size(dst, sftp) < start:
+            # 写了一半的目标文件被删掉或者截短了，只能从头开始
+            logger.debug(f'{dst} 比日志里的偏移量 {start} 短, 从头传输')
+            start = 0
+        transferred = start
+
+        def on_chunk(n, committed, sent):
+            # n 是进度，包括跳过的空洞；sent 是真正走网络的字节，吞吐量只按它算
+            nonlocal transferred
+            transferred += n
+            with self._lock:
+                self._done += n
+                self.transferred += sent
+            if self.job_id is not None:
+                self.journal.update(self.job_id, src, committed, ACTIVE)
+
+        with self._lock:
+            self._done += start
+        if self.direction == 'upload':
+            if not start and not self.force and self.executor.check_remote_file(dst):
+                if logconfig.enabled('DEBUG'):
+                    logger.debug(f'{dst} 已经存在, 跳过')
+                with self._lock:
+                    self.skipped += 1
+            else:
+                self.executor.put_file(src, dst, sftp=sftp, start=start, callback=on_chunk)
+        else:
+            # 只有大小一致才算已经下载过，写了一半的文件要从断点继续
+            if not start and not self.force and self.executor.check_local_file(dst, size):
+                if logconfig.enabled('DEBUG'):
+                    logger.debug(f'{dst} 已经存在, 跳过')
+                with self._lock:
+                    self.skipped += 1
+            else:
+                self.executor.get_file(src, dst, sftp=sftp, start=start, callback=on_chunk)
+        with self._lock:
+            self._done += size - transferred
+        if self.job_id is not None:
+            self.journal.update(self.job_id, src, size, DONE)
+
+    def _partial_size(self, dst, sftp):
+        # 断点续传前确认目标文件还在，不存在时返回 -1
+        try:
+            if self.direction == 'upload':
+                return sftp.stat(dst).st_size
+            return os.path.getsize(dst)
+        except (IOError, OSError):
+            return -1
+
+    def run(self, progress=None):
+        # progress(已完成字节, 总字节) 在调用者的线程里回调，返回出错的 [(路径, 错误)]
+        # 同步时文件可能全部被跳过，不能因为列表是空的就重新规划
+        if not self.planned:
+            self.plan()
+        total = sum(size for _, _, size in self.files)
+        errors = []
+        self._done = 0
+        self.transferred = 0
+        self.skipped = 0
+        self._channels = []
+        self._local = threading.local()
+        if self.job_id is None:
+            self.job_id = self.journal.start_job(self.direction, self.executor.hostname, self.items, self.files)
+        self._make_dirs()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._transfer_one, *f): f[0] for f in self.files}
+                pending = set(futures)
+                while pending:
+                    finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        if future.exception() is not None:
+                            errors.append((futures[future], future.exception()))
+                    if progress is not None:
+                        progress(self._done, total)
+        finally:
+            for sftp in self._channels:
+                sftp.close()
+        for path, e in errors:
+            logger.error(f'{self.direction} 失败 {path}: {e}')
+        if errors:
+            self.journal.flush()
+        else:
+            self.journal.finish_job(self.job_id)
+        # 把这次调出来的参数记下来，下次连接同一台主机时直接用
+        if self.executor.tuner is not None:
+            self.executor.tuner.save()
+        return errors
@@ -0,0 +1,71 @@
+import os, sys, time, resource
+from collections import OrderedDict
+
+ROW_BYTES = 1700  # 一行三个 QStandardItem 加上 PyQt 的包装对象，实测大约 1.7KB
+INFO_BYTES = 200  # 一个带 __slots__ 的 FileInfo 大约 200 字节
+
+
+class ListPager:
+    # 和 FileInfoPager 一样的接口，从缓存的列表里分页返回
+    def __init__(self, file_infos):
+        self.file_infos = file_infos
+        self.pos = 0
+
+    @property
+    def exhausted(self):
+        return self.pos >= len(self.file_infos)
+
+    def next_page(self, count):
+        page = self.file_infos[self.pos:self.pos + count]
+        self.pos += len(page)
+        return page
+
+    def close(self):
+        self.pos = len(self.file_infos)
+
+
+class ListingCache:
+    # 从树里换出去的目录列表，按 LRU 保存 FileInfo，比 QStandardItem 小得多
+    # 超过预算的最旧的丢掉，超过 max_age 的也不用，下次展开时重新列目录
+    def __init__(self, budget=32 * 1024 * 1024, max_age=300):
+        self.budget = budget
+        self.max_age = max_age
+        self._listings = OrderedDict()  # {path: (保存的时间, [FileInfo])}
+        self.entries = 0
+
+    @property
+    def nbytes(self):
+        return self.entries * INFO_BYTES
+
+    def put(self, path, file_infos):
+        self.discard(path)
+        self._listings[path] = (time.monotonic(), file_infos)
+        self.entries += len(file_infos)
+        while self.nbytes > self.budget and self._listings:
+            _, (_, old) = self._listings.popitem(last=False)
+            self.entries -= len(old)
+
+    def pop(self, path):
+        item = self._listings.pop(path, None)
+        if item is None:
+            return None
+        saved, file_infos = item
+        self.entries -= len(file_infos)
+        if time.monotonic() - saved > self.max_age:
+            return None
+        return file_infos
+
+    def discard(self, path):
+        item = self._listings.pop(path, None)
+        if item is not None:
+            self.entries -= len(item[1])
+
+
+def process_rss():
+    # 当前进程的常驻内存，没有 /proc 的系统用 getrusage 的峰值代替
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
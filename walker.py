@@ -0,0 +1,207 @@
+import posixpath, stat
+from collections import deque
+from paramiko.sftp import CMD_OPENDIR, CMD_READDIR, CMD_CLOSE, CMD_MKDIR, CMD_READLINK, CMD_STAT, CMD_HANDLE, CMD_NAME, CMD_STATUS, CMD_ATTRS
+from paramiko.sftp_attr import SFTPAttributes
+from transfercore import AsyncResponses, wait_response
+import logconfig
+import loguru
+
+logger = loguru.logger
+
+
+def walk(sftp, root, max_inflight=64):
+    # 流水线方式遍历远程目录树：同时有多个目录的 opendir/readdir 请求在途，
+    # 不用等一个目录列完再列下一个。发现一个条目就 yield (完整路径, SFTPAttributes)
+    # 属性是 lstat 的结果，符号链接不跟进去，readlink 之后带着 attr.link_target 再 yield
+    responses = AsyncResponses()
+    pending_dirs = deque([root])
+    inflight = {}  # {请求号: (类型, 目录, handle)}
+
+    def send(kind, path, handle=None):
+        if kind == 'opendir':
+            num = sftp._async_request(responses, CMD_OPENDIR, path)
+        elif kind == 'readdir':
+            num = sftp._async_request(responses, CMD_READDIR, handle)
+        elif kind == 'readlink':
+            num = sftp._async_request(responses, CMD_READLINK, path)
+        else:
+            num = sftp._async_request(responses, CMD_CLOSE, handle)
+        inflight[num] = (kind, path, handle)
+
+    try:
+        while pending_dirs or inflight:
+            while pending_dirs and len(inflight) < max_inflight:
+                send('opendir', pending_dirs.popleft())
+            while not responses.results:
+                sftp._read_response()
+            # 哪个响应先到就先处理哪个
+            for num in list(responses.results):
+                t, msg = responses.results.pop(num)
+                kind, path, handle = inflight.pop(num)
+                if kind == 'opendir':
+                    if t == CMD_HANDLE:
+                        send('readdir', path, msg.get_binary())
+                    else:
+                        _log_status(sftp, msg, path)
+                elif kind == 'readlink':
+                    # handle 的位置放的是链接自己的属性
+                    attr = handle
+                    if t == CMD_NAME and msg.get_int() == 1:
+                        attr.link_target = msg.get_text()
+                    else:
+                        _log_status(sftp, msg, path, 'readlink')
+                    yield path, attr
+                elif kind == 'readdir':
+                    if t != CMD_NAME:
+                        # EOF，这个目录读完了
+                        send('close', path, handle)
+                        continue
+                    entries = []
+                    for _ in range(msg.get_int()):
+                        filename = msg.get_text()
+                        longname = msg.get_text()
+                        attr = SFTPAttributes._from_msg(msg, filename, longname)
+                        if filename not in ('.', '..'):
+                            entries.append(attr)
+                    send('readdir', path, handle)
+                    for attr in entries:
+                        full_path = posixpath.join(path, attr.filename)
+                        if stat.S_ISLNK(attr.st_mode):
+                            send('readlink', full_path, attr)
+                            continue
+                        if stat.S_ISDIR(attr.st_mode):
+                            pending_dirs.append(full_path)
+                        yield full_path, attr
+    except GeneratorExit:
+        # 调用方提前结束时把在途的响应读完，再关闭已经打开的目录
+        handles = [handle for kind, path, handle in inflight.values() if kind == 'readdir']
+        while inflight:
+            while not responses.results:
+                sftp._read_response()
+            for num in list(responses.results):
+                t, msg = responses.results.pop(num)
+                kind, path, handle = inflight.pop(num)
+                if kind == 'opendir' and t == CMD_HANDLE:
+                    handles.append(msg.get_binary())
+        for handle in handles:
+            sftp._request(CMD_CLOSE, handle)
+        raise
+
+
+def _log_status(sftp, msg, path, op='opendir'):
+    if not logconfig.enabled('DEBUG'):
+        return
+    try:
+        sftp._convert_status(msg)
+    except (IOError, EOFError) as e:
+        logger.debug(f'{op} {path} 失败: {e}')
+
+
+def mkdirs(sftp, dirs, max_inflight=64):
+    # 按顺序流水线发送 mkdir，服务器按顺序处理所以父目录总是先建好
+    # 失败的再用 stat 确认一下是不是本来就存在
+    responses = AsyncResponses()
+    inflight = deque()
+    failed = []
+    for dir_path in dirs:
+        inflight.append((sftp._async_request(responses, CMD_MKDIR, dir_path, SFTPAttributes()), dir_path))
+        if len(inflight) >= max_inflight:
+            _finish_mkdir(sftp, responses, inflight.popleft(), failed)
+    while inflight:
+        _finish_mkdir(sftp, responses, inflight.popleft(), failed)
+    for dir_path in failed:
+        if not stat.S_ISDIR(sftp.stat(dir_path).st_mode):
+            raise IOError(f'{dir_path} 已经存在并且不是目录')
+
+
+def stat_many(sftp, paths, max_inflight=64):
+    # 流水线发送 stat（跟随符号链接），按顺序返回 SFTPAttributes，一批源只要一次往返的时间
+    # 有失败的先把在途的响应读完，再抛出第一个错误
+    responses = AsyncResponses()
+    inflight = deque()
+    attrs = []
+    error = None
+    for path in paths:
+        inflight.append((sftp._async_request(responses, CMD_STAT, path), path))
+        if len(inflight) >= max_inflight:
+            failed = _finish_stat(sftp, responses, inflight.popleft(), attrs)
+            error = error or failed
+    while inflight:
+        failed = _finish_stat(sftp, responses, inflight.popleft(), attrs)
+        error = error or failed
+    if error is not None:
+        raise error
+    return attrs
+
+
+def _finish_stat(sftp, responses, request, attrs):
+    num, path = request
+    t, msg = wait_response(sftp, responses, num)
+    if t == CMD_ATTRS:
+        attrs.append(SFTPAttributes._from_msg(msg))
+        return None
+    try:
+        sftp._convert_status(msg)
+    except IOError as e:
+        return e
+    return IOError(f'unexpected response to stat {path}')
+
+
+def _finish_mkdir(sftp, responses, request, failed):
+    num, dir_path = request
+    while num not in responses.results:
+        sftp._read_response()
+    t, msg = responses.results.pop(num)
+    if t == CMD_STATUS:
+        try:
+            sftp._convert_status(msg)
+        except IOError:
+            failed.append(dir_path)
+
+
+class DirPager:
+    # 分页读取一个远程目录，每次只读够一页就停下来，目录 handle 保留到读完为止
+    # 请求都带编号，两页之间 sftp 上可以穿插其他请求
+    def __init__(self, sftp, path):
+        self.sftp = sftp
+        self.path = path
+        self.responses = AsyncResponses()
+        self.buffer = deque()
+        self.done = False
+        t, msg = sftp._request(CMD_OPENDIR, path)
+        self.handle = msg.get_binary()
+        # 预先发出一个 readdir，下一页的第一批数据在用户滚动之前就已经在路上了
+        self._next = self._send()
+
+    def _send(self):
+        return self.sftp._async_request(self.responses, CMD_READDIR, self.handle)
+
+    @property
+    def exhausted(self):
+        return self.done and not self.buffer
+
+    def next_page(self, count):
+        # 返回最多 count 个 SFTPAttributes
+        while len(self.buffer) < count and not self.done:
+            t, msg = wait_response(self.sftp, self.responses, self._next)
+            if t != CMD_NAME:
+                self._finish()
+                break
+            for _ in range(msg.get_int()):
+                filename = msg.get_text()
+                longname = msg.get_text()
+                attr = SFTPAttributes._from_msg(msg, filename, longname)
+                if filename not in ('.', '..'):
+                    self.buffer.append(attr)
+            self._next = self._send()
+        return [self.buffer.popleft() for _ in range(min(count, len(self.buffer)))]
+
+    def _finish(self):
+        self.done = True
+        self.sftp._request(CMD_CLOSE, self.handle)
+
+    def close(self):
+        if not self.done:
+            wait_response(self.sftp, self.responses, self._next)
+            self._finish()
+        self.buffer.clear()